@@ -8,19 +8,22 @@ snapshot and appends a full row with a Unix timestamp to the buffer.
 """
 
 import argparse
+import bisect
+import heapq
 import math
 import os
+import queue
 import sys
 import threading
 import time
 from collections import defaultdict, deque
 from dataclasses import dataclass
-from typing import Dict, Iterable, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 import numpy as np
 from dotenv import load_dotenv
 from ibapi.client import EClient
-from ibapi.common import TickAttrib
+from ibapi.common import TickAttrib, TickAttribBidAsk, TickAttribLast
 from ibapi.contract import Contract
 from ibapi.wrapper import EWrapper
 from loguru import logger
@@ -43,9 +46,20 @@ logger.add(sys.stderr, format="{time:MMMM D, YYYY > HH:mm:ss} | {level} | {messa
 # Buffer implementation
 # -----------------------------------------------------------------------------
 
+# Integer-tick value of a missing price.
+PRICE_NAN = int(np.iinfo(np.int32).min)
+
+
 @dataclass
 class Snapshot:
-    """Holds the latest tick values for a given ticker id."""
+    """
+    Holds the latest tick values for a given ticker id. ``*_ticks`` are the
+    prices converted to integer ticks once at ingest (``PRICE_NAN`` when
+    unknown); the aggregation windows bin those instead of the floats.
+    ``exchange_time`` is the exchange timestamp of the latest tick-by-tick
+    message (NaN with ``reqMktData``); rows are always stamped with the
+    local receive time.
+    """
 
     bid_size: float = np.nan
     bid_price: float = np.nan
@@ -54,14 +68,64 @@ class Snapshot:
     last_price: float = np.nan
     last_size: float = np.nan
     volume: float = np.nan
+    bid_ticks: int = PRICE_NAN
+    ask_ticks: int = PRICE_NAN
+    last_ticks: int = PRICE_NAN
+    exchange_time: float = np.nan
+
+
+def ring_slices(start: int, count: int,
+                capacity: int) -> List[Tuple[slice, slice]]:
+    """
+    Split ``count`` logical rows starting at ring index ``start`` into at
+    most two (ring slice, source slice) pairs.
+    """
+    first = min(count, capacity - start)
+    pairs = [(slice(start, start + first), slice(0, first))]
+    if first < count:
+        pairs.append((slice(0, count - first), slice(first, count)))
+    return pairs
 
 
 class OrderFlowBuffer:
     """
     Circular buffer that stores the latest tick snapshots in a structured numpy
-    array. Each row captures the full state after a tick arrives.
+    array. Each row captures the full state after a tick arrives. Rows about
+    to be overwritten are passed to ``eviction_sink.stage`` when a sink (e.g.
+    :class:`SegmentWriter`) is given.
+
+    When ``path`` is given the ring lives in a memory-mapped file preceded by a
+    small header (capacity, write index, size, sequence). The header is
+    updated after every write so the file can be reopened after a crash, or
+    opened read-only by other processes that want to read the live ring
+    without copies.
+
+    There is a single writer and any number of lock-free readers. Before
+    touching the ring the writer publishes ``claimed`` (the sequence number it
+    is about to reach) and after the rows are written it publishes
+    ``sequence``. Row ``s`` always lives at ring index ``s % capacity``, so
+    :meth:`read_range` can copy rows without a lock and afterwards drop the
+    ones the writer may have overwritten meanwhile (seqlock style).
+
+    ``profile="compact"`` stores rows as ``compact_dtype`` (43 instead of 72
+    bytes): nanosecond timestamps, narrow ids, float32 sizes and prices as
+    integer ticks. ``price_scales`` maps a ticker id to its number of price
+    ticks per unit (100 for cent-priced stocks). Rows are decoded back to
+    ``dtype`` by ``to_array``/``tail``; ``views`` hand out the stored rows.
     """
 
+    HEADER_SIZE = 64
+    MAGIC = b"OFBUF001"
+    header_dtype = np.dtype([
+        ("magic", "S8"),
+        ("row_size", "int64"),
+        ("capacity", "int64"),
+        ("write_idx", "int64"),
+        ("size", "int64"),
+        ("sequence", "int64"),
+        ("claimed", "int64"),
+    ])
+
     dtype = np.dtype([
         ("timestamp", "float64"),
         ("ticker_id", "int32"),
@@ -75,17 +139,169 @@ class OrderFlowBuffer:
         ("volume", "float64"),
     ])
 
-    def __init__(self, capacity: int):
+    # Cumulative volume stays float64: float32 is only exact up to 2**24.
+    compact_dtype = np.dtype([
+        ("timestamp", "int64"),
+        ("ticker_id", "uint16"),
+        ("tick_type", "uint8"),
+        ("bid_size", "float32"),
+        ("bid_price", "int32"),
+        ("ask_price", "int32"),
+        ("ask_size", "float32"),
+        ("last_price", "int32"),
+        ("last_size", "float32"),
+        ("volume", "float64"),
+    ])
+    profiles = {"default": dtype, "compact": compact_dtype}
+    price_fields = ("bid_price", "ask_price", "last_price")
+    PRICE_NAN = PRICE_NAN
+    DEFAULT_PRICE_SCALE = 100
+
+    def __init__(self, capacity: int, path: Optional[str] = None,
+                 readonly: bool = False, profile: str = "default",
+                 price_scales: Optional[Dict[int, int]] = None,
+                 eviction_sink: Optional["SegmentWriter"] = None):
         if capacity <= 0:
             raise ValueError("capacity must be positive")
+        if profile not in self.profiles:
+            raise ValueError(f"unknown buffer profile {profile!r}")
         self.capacity = capacity
-        self._data = np.full(capacity, np.nan, dtype=self.dtype)
+        self.path = path
+        self.readonly = readonly
+        self.profile = profile
+        self.storage_dtype = self.profiles[profile]
+        self._compact = profile == "compact"
+        self.eviction_sink = eviction_sink
+        self.price_scales: Dict[int, int] = dict(price_scales or {})
+        self._scale_table = np.full(np.iinfo(np.uint16).max + 1,
+                                    self.DEFAULT_PRICE_SCALE, dtype="float64")
+        for ticker_id, scale in self.price_scales.items():
+            self._scale_table[ticker_id] = scale
+        self._header: Optional[np.ndarray] = None
         self._write_idx = 0
         self.size = 0
-        logger.debug("OrderFlowBuffer initialized with capacity {}", capacity)
-
-    def append(self, ticker_id: int, tick_type: int, snapshot: Snapshot) -> None:
-        now = time.time()
+        # Total number of rows ever appended; stamps views for consumers.
+        self.sequence = 0
+        # Sequence the writer is about to reach; see read_range.
+        self._claimed = 0
+        if path is None:
+            if readonly:
+                raise ValueError("readonly requires a file-backed buffer")
+            self._data = self._empty_rows(capacity)
+            logger.debug("OrderFlowBuffer initialized with capacity {} ({} profile)",
+                         capacity, profile)
+        else:
+            self._open_file(path)
+
+    @classmethod
+    def open(cls, path: str, readonly: bool = True,
+             price_scales: Optional[Dict[int, int]] = None) -> "OrderFlowBuffer":
+        """
+        Reopen an existing file-backed buffer, reading its capacity and
+        profile from the header.
+        """
+        header = np.fromfile(path, dtype=cls.header_dtype, count=1)
+        if header.size == 0 or header["magic"][0] != cls.MAGIC:
+            raise ValueError(f"{path} is not an OrderFlowBuffer file")
+        row_size = int(header["row_size"][0])
+        profile = next((name for name, dtype in cls.profiles.items()
+                        if dtype.itemsize == row_size), None)
+        if profile is None:
+            raise ValueError(f"{path} has an unknown row size {row_size}")
+        return cls(int(header["capacity"][0]), path=path, readonly=readonly,
+                   profile=profile, price_scales=price_scales)
+
+    def _empty_rows(self, count: int) -> np.ndarray:
+        rows = np.empty(count, dtype=self.storage_dtype)
+        self._fill_empty(rows)
+        return rows
+
+    def _fill_empty(self, rows: np.ndarray) -> None:
+        np.copyto(rows, np.nan, casting="unsafe")
+        if self._compact:
+            for name in self.price_fields:
+                rows[name] = self.PRICE_NAN
+
+    def _open_file(self, path: str) -> None:
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if self.readonly and not exists:
+            raise FileNotFoundError(path)
+        if not exists:
+            with open(path, "wb") as handle:
+                handle.truncate(self.HEADER_SIZE
+                                + self.capacity * self.storage_dtype.itemsize)
+        mode = "r" if self.readonly else "r+"
+        self._header = np.memmap(path, dtype=self.header_dtype, mode=mode,
+                                 shape=(1,))
+        header = self._header[0]
+        if exists:
+            if header["magic"] != self.MAGIC:
+                raise ValueError(f"{path} is not an OrderFlowBuffer file")
+            if header["row_size"] != self.storage_dtype.itemsize:
+                raise ValueError(f"{path} was written with a different row layout")
+            if header["capacity"] != self.capacity:
+                raise ValueError(
+                    f"{path} has capacity {int(header['capacity'])}, "
+                    f"expected {self.capacity}")
+        self._data = np.memmap(path, dtype=self.storage_dtype, mode=mode,
+                               offset=self.HEADER_SIZE, shape=(self.capacity,))
+        if exists:
+            self.refresh()
+            if not self.readonly and self._claimed != self.sequence:
+                # A batch was torn by a crash: its slots are already trimmed
+                # from ``size`` and get overwritten by the next appends.
+                logger.warning("OrderFlowBuffer {}: discarding {} rows of an "
+                               "interrupted write", path,
+                               self._claimed - self.sequence)
+                self._claimed = self.sequence
+                self._sync_header()
+            logger.info("OrderFlowBuffer reopened {} ({} rows, readonly={})",
+                        path, self.size, self.readonly)
+        else:
+            self._fill_empty(self._data)
+            header["magic"] = self.MAGIC
+            header["row_size"] = self.storage_dtype.itemsize
+            header["capacity"] = self.capacity
+            self._sync_header()
+            logger.debug("OrderFlowBuffer created {} with capacity {}",
+                         path, self.capacity)
+
+    def _sync_header(self) -> None:
+        # Rows are written before the header so it never points past valid data.
+        header = self._header[0]
+        header["write_idx"] = self._write_idx
+        header["size"] = self.size
+        header["sequence"] = self.sequence
+        header["claimed"] = self._claimed
+
+    def refresh(self) -> None:
+        """
+        Reload the write position from the file header (file-backed mode).
+        Rows in the slots of a write that is in progress, or was torn by a
+        crash (``claimed > sequence``), are not counted in ``size``.
+        """
+        if self._header is None:
+            return
+        header = self._header[0]
+        self._write_idx = int(header["write_idx"])
+        self.sequence = int(header["sequence"])
+        self._claimed = int(header["claimed"])
+        pending = max(0, self._claimed - self.sequence)
+        self.size = min(int(header["size"]), max(0, self.capacity - pending))
+
+    def _claim(self, count: int) -> None:
+        self._claimed = self.sequence + count
+        if self._header is not None:
+            self._header[0]["claimed"] = self._claimed
+
+    def flush(self) -> None:
+        if self._header is not None and not self.readonly:
+            self._data.flush()
+            self._header.flush()
+
+    def append(self, ticker_id: int, tick_type: int, snapshot: Snapshot,
+               timestamp: Optional[float] = None) -> None:
+        now = time.time() if timestamp is None else timestamp
         row = (
             now,
             ticker_id,
@@ -98,112 +314,2267 @@ class OrderFlowBuffer:
             snapshot.last_size,
             snapshot.volume,
         )
+        if self._compact:
+            row = self._encode_row(row)
+        if self.eviction_sink is not None and self.size == self.capacity:
+            self.eviction_sink.stage(self._data[self._write_idx:self._write_idx + 1])
 
+        self._claim(1)
         self._data[self._write_idx] = row
         self._write_idx = (self._write_idx + 1) % self.capacity
         if self.size < self.capacity:
             self.size += 1
+        self.sequence += 1
+        if self._header is not None:
+            self._sync_header()
+
+    def _encode_row(self, row: tuple) -> tuple:
+        now, ticker_id, tick_type, bid_size, bid_price, ask_price, ask_size, \
+            last_price, last_size, volume = row
+        scale = self.price_scales.get(ticker_id, self.DEFAULT_PRICE_SCALE)
+        return (
+            self._timestamp_key(now),
+            ticker_id,
+            tick_type,
+            bid_size,
+            self._price_ticks(bid_price, scale),
+            self._price_ticks(ask_price, scale),
+            ask_size,
+            self._price_ticks(last_price, scale),
+            last_size,
+            volume,
+        )
 
-    def to_array(self) -> np.ndarray:
-        if self.size == 0:
+    def _timestamp_key(self, timestamp: float):
+        """Convert a Unix timestamp to the representation stored in the ring."""
+        if not self._compact:
+            return timestamp
+        seconds = math.floor(timestamp)
+        return seconds * 1_000_000_000 + round((timestamp - seconds) * 1e9)
+
+    def _price_ticks(self, price: float, scale: int) -> int:
+        if math.isnan(price):
+            return self.PRICE_NAN
+        return round(price * scale)
+
+    def _encode_columns(self, columns: Dict[str, np.ndarray]) -> None:
+        """Convert logical columns (``dtype``) to ``compact_dtype`` in place."""
+        timestamps = columns["timestamp"]
+        seconds = np.floor(timestamps)
+        columns["timestamp"] = (seconds.astype("int64") * 1_000_000_000
+                                + np.rint((timestamps - seconds) * 1e9).astype("int64"))
+        scales = self._scale_table[columns["ticker_id"]]
+        for name in self.price_fields:
+            scaled = columns[name] * scales
+            nan_mask = np.isnan(scaled)
+            ticks = np.rint(np.where(nan_mask, 0.0, scaled)).astype("int32")
+            ticks[nan_mask] = self.PRICE_NAN
+            columns[name] = ticks
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        """Return ``rows`` (as stored, e.g. from ``views``) in the ``dtype`` layout."""
+        if not self._compact:
+            return rows.copy()
+        out = np.empty(rows.shape[0], dtype=self.dtype)
+        timestamps = rows["timestamp"]
+        seconds = timestamps // 1_000_000_000
+        out["timestamp"] = seconds + (timestamps - seconds * 1_000_000_000) / 1e9
+        out["ticker_id"] = rows["ticker_id"]
+        out["tick_type"] = rows["tick_type"]
+        scales = self._scale_table[rows["ticker_id"]]
+        for name in ("bid_size", "ask_size", "last_size", "volume"):
+            out[name] = rows[name]
+        for name in self.price_fields:
+            ticks = rows[name]
+            prices = ticks / scales
+            prices[ticks == self.PRICE_NAN] = np.nan
+            out[name] = prices
+        return out
+
+    def append_many(self, timestamps, ticker_ids, tick_types, *,
+                    bid_size=None, bid_price=None, ask_price=None,
+                    ask_size=None, last_price=None, last_size=None,
+                    volume=None) -> None:
+        """
+        Append a batch of rows by writing whole column slices into the ring.
+
+        ``ticker_ids`` and ``tick_types`` may be scalars that apply to every
+        row. Snapshot fields that are omitted are stored as NaN. When the
+        batch is larger than the capacity only its newest rows are kept.
+        """
+        timestamps = np.asarray(timestamps, dtype="float64")
+        if timestamps.ndim != 1:
+            raise ValueError("timestamps must be one-dimensional")
+        count = timestamps.shape[0]
+        if count == 0:
+            return
+
+        columns = {
+            "timestamp": timestamps,
+            "ticker_id": ticker_ids,
+            "tick_type": tick_types,
+            "bid_size": bid_size,
+            "bid_price": bid_price,
+            "ask_price": ask_price,
+            "ask_size": ask_size,
+            "last_price": last_price,
+            "last_size": last_size,
+            "volume": volume,
+        }
+        for name, values in columns.items():
+            if values is None:
+                values = np.nan
+            values = np.broadcast_to(
+                np.asarray(values, dtype=self.dtype[name]), (count,))
+            columns[name] = values
+        if self._compact:
+            self._encode_columns(columns)
+
+        skip = max(0, count - self.capacity)
+        kept = count - skip
+        if self.eviction_sink is not None:
+            self._evict(columns, kept, skip)
+        self._claim(count)
+        # Skipped rows still consume ring positions so that row ``s`` stays
+        # at index ``s % capacity``.
+        pairs = ring_slices((self._write_idx + skip) % self.capacity, kept,
+                            self.capacity)
+        for name, values in columns.items():
+            column = self._data[name]
+            values = values[skip:]
+            for ring_slice, src_slice in pairs:
+                column[ring_slice] = values[src_slice]
+
+        self._write_idx = (self._write_idx + count) % self.capacity
+        self.size = min(self.capacity, self.size + kept)
+        self.sequence += count
+        if self._header is not None:
+            self._sync_header()
+
+    def _evict(self, columns: Dict[str, np.ndarray], kept: int, skip: int) -> None:
+        """Stage the ring rows a batch will overwrite, then rows it skips."""
+        evicted = self.size + kept - self.capacity
+        if evicted > 0:
+            oldest = (self._write_idx - self.size) % self.capacity
+            for ring_slice, _src in ring_slices(oldest, evicted, self.capacity):
+                self.eviction_sink.stage(self._data[ring_slice])
+        if skip:
+            spilled = np.empty(skip, dtype=self.storage_dtype)
+            for name, values in columns.items():
+                spilled[name] = values[:skip]
+            self.eviction_sink.stage(spilled)
+
+    def _readonly_slice(self, start: int, stop: int) -> np.ndarray:
+        view = self._data[start:stop]
+        view.flags.writeable = False
+        return view
+
+    def tail_views(self, n: int) -> Tuple[Tuple[np.ndarray, ...], int]:
+        """
+        Return the newest ``n`` rows as one or two read-only slices of the
+        ring (oldest first, in ``storage_dtype``) together with the sequence number of the newest
+        row. Nothing is copied: the slices stay valid while
+        ``buffer.sequence - stamp <= capacity - n``, after which the writer
+        starts overwriting them.
+        """
+        if self.readonly:
+            self.refresh()
+        n = min(n, self.size)
+        if n <= 0:
+            return (), self.sequence
+        start = (self._write_idx - n) % self.capacity
+        views = tuple(self._readonly_slice(ring_slice.start, ring_slice.stop)
+                      for ring_slice, _src in ring_slices(start, n, self.capacity))
+        return views, self.sequence
+
+    def views(self) -> Tuple[Tuple[np.ndarray, ...], int]:
+        """Zero-copy equivalent of :meth:`to_array`; see :meth:`tail_views`."""
+        return self.tail_views(self.capacity)
+
+    @property
+    def oldest_sequence(self) -> int:
+        """Sequence number of the oldest row that is not being overwritten."""
+        if self.readonly:
+            self.refresh()
+        return max(0, self._claimed - self.capacity)
+
+    def subscribe(self, from_start: bool = False) -> "BufferCursor":
+        """
+        Return a cursor that reads rows appended after this call (or every
+        retained row when ``from_start`` is true).
+        """
+        if self.readonly:
+            self.refresh()
+        return BufferCursor(self, self.oldest_sequence if from_start else self.sequence)
+
+    def read_range(self, start: int, stop: Optional[int] = None) -> Tuple[np.ndarray, int]:
+        """
+        Copy the rows with sequence numbers in ``[start, stop)`` without
+        taking a lock, decoded to ``dtype``. Returns ``(rows, first)`` where
+        ``first`` is the sequence number of ``rows[0]``; it is larger than
+        ``start`` when older rows had already been, or were being,
+        overwritten by the writer during the copy.
+        """
+        if self.readonly:
+            self.refresh()
+        committed = self.sequence
+        stop = committed if stop is None else min(stop, committed)
+        start = max(start, committed - self.capacity, 0)
+        if start >= stop:
+            return np.empty(0, dtype=self.dtype), stop
+        views = tuple(self._readonly_slice(ring_slice.start, ring_slice.stop)
+                      for ring_slice, _src in ring_slices(
+                          start % self.capacity, stop - start, self.capacity))
+        rows = self._join(views)
+        claimed = int(self._header[0]["claimed"]) if self.readonly else self._claimed
+        first_valid = claimed - self.capacity
+        if start < first_valid:
+            rows = rows[min(first_valid, stop) - start:]
+            start = min(first_valid, stop)
+        return rows, start
+
+    def between_views(self, t0: float, t1: float
+                      ) -> Tuple[Tuple[np.ndarray, ...], int]:
+        """
+        Return rows with ``t0 <= timestamp <= t1`` as read-only ring slices
+        plus the sequence stamp, like :meth:`views`. Timestamps are monotonic
+        in ring order, so each of the (at most two) segments is binary
+        searched: O(log n) and nothing is copied.
+        """
+        views, sequence = self.views()
+        lo_key = self._timestamp_key(t0)
+        hi_key = self._timestamp_key(t1)
+        matches = []
+        for view in views:
+            stamps = view["timestamp"]
+            lo = bisect.bisect_left(stamps, lo_key)
+            hi = bisect.bisect_right(stamps, hi_key, lo)
+            if lo < hi:
+                matches.append(view[lo:hi])
+        return tuple(matches), sequence
+
+    def since_views(self, t: float) -> Tuple[Tuple[np.ndarray, ...], int]:
+        """Return rows with ``timestamp >= t``; see :meth:`between_views`."""
+        views, sequence = self.views()
+        key = self._timestamp_key(t)
+        matches = []
+        for view in views:
+            lo = bisect.bisect_left(view["timestamp"], key)
+            if lo < len(view):
+                matches.append(view[lo:])
+        return tuple(matches), sequence
+
+    def _join(self, views: Tuple[np.ndarray, ...]) -> np.ndarray:
+        if not views:
             return np.empty(0, dtype=self.dtype)
-        idx = (self._write_idx - self.size) % self.capacity
-        if idx + self.size <= self.capacity:
-            return self._data[idx: idx + self.size].copy()
-        first_part = self._data[idx:].copy()
-        second_part = self._data[:self._write_idx].copy()
-        return np.concatenate((first_part, second_part))
+        if len(views) == 1:
+            return self.decode(views[0])
+        return self.decode(np.concatenate(views))
+
+    def to_array(self) -> np.ndarray:
+        return self._join(self.views()[0])
+
+    def between(self, t0: float, t1: float) -> np.ndarray:
+        """Decoded copy of the rows with ``t0 <= timestamp <= t1``."""
+        return self._join(self.between_views(t0, t1)[0])
+
+    def since(self, t: float) -> np.ndarray:
+        """Decoded copy of the rows with ``timestamp >= t``."""
+        return self._join(self.since_views(t)[0])
 
     def tail(self, n: int) -> np.ndarray:
-        if n <= 0 or self.size == 0:
+        return self._join(self.tail_views(n)[0])
+
+
+class BufferCursor:
+    """
+    Incremental reader returned by ``subscribe()``. Each :meth:`read_new`
+    call returns only the rows appended since the previous one, so a
+    consumer's cost is O(new rows) per poll.
+    """
+
+    def __init__(self, buffer, position: int):
+        self.buffer = buffer
+        self.position = position
+        self.missed = 0
+
+    @property
+    def lag(self) -> int:
+        """Rows appended but not yet read by this cursor."""
+        return self.buffer.sequence - self.position
+
+    def read_new(self, max_rows: Optional[int] = None) -> Tuple[np.ndarray, int]:
+        """
+        Return ``(rows, missed)``: up to ``max_rows`` new rows (decoded to
+        ``OrderFlowBuffer.dtype``) and how many rows were overwritten before
+        this cursor could read them. ``missed`` is also accumulated in
+        :attr:`missed`.
+        """
+        start = max(self.position, self.buffer.oldest_sequence)
+        stop = None if max_rows is None else start + max_rows
+        rows, first = self.buffer.read_range(start, stop)
+        missed = first - self.position
+        self.missed += missed
+        self.position = first + rows.shape[0]
+        return rows, missed
+
+
+class SegmentWriter:
+    """
+    Eviction sink that keeps rows overwritten in a ring buffer on disk.
+
+    The producer thread only copies evicted rows into a preallocated staging
+    block (:meth:`stage`). Full blocks are handed to a background thread that
+    appends them as raw ``.npy`` chunks to rotating segment files and records
+    each chunk in ``index.csv`` (file, offset, rows, earliest/latest
+    timestamp) so :func:`load_segments` can read a time range back without
+    scanning everything. If the writer falls behind and no staging block is
+    free, rows are dropped rather than blocking the producer: they are
+    counted in ``dropped_rows`` (see :meth:`stats`) and a warning is logged
+    at most every ``DROP_WARNING_INTERVAL`` seconds.
+    """
+
+    INDEX_NAME = "index.csv"
+    DROP_WARNING_INTERVAL = 10.0
+
+    def __init__(self, directory: str, dtype: np.dtype, block_rows: int = 8192,
+                 segment_rows: int = 1_000_000, pool_blocks: int = 8):
+        if block_rows <= 0 or segment_rows <= 0 or pool_blocks < 2:
+            raise ValueError("block_rows/segment_rows must be positive, pool_blocks >= 2")
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.block_rows = block_rows
+        self.segment_rows = segment_rows
+        self.dropped_rows = 0
+        self.written_rows = 0
+        self._drop_warned_at = -math.inf
+        os.makedirs(directory, exist_ok=True)
+        self._free: "queue.Queue[np.ndarray]" = queue.Queue()
+        for _ in range(pool_blocks - 1):
+            self._free.put(np.empty(block_rows, dtype=self.dtype))
+        self._pending: "queue.Queue[Optional[Tuple[np.ndarray, int]]]" = queue.Queue()
+        self._block = np.empty(block_rows, dtype=self.dtype)
+        self._fill = 0
+        self._segment_id = self._next_segment_id()
+        self._segment_fill = 0
+        self._thread = threading.Thread(target=self._run, name="SegmentWriter",
+                                        daemon=True)
+        self._thread.start()
+        logger.debug("SegmentWriter spilling evicted rows to {}", directory)
+
+    # ------------------------------------------------------------------
+    # Producer side (tick thread)
+    # ------------------------------------------------------------------
+
+    def stage(self, rows: np.ndarray) -> None:
+        """Copy ``rows`` (about to be overwritten) into the staging block."""
+        offset = 0
+        count = rows.shape[0]
+        while offset < count:
+            if self._block is None:
+                self._block = self._take_free_block()
+                if self._block is None:
+                    self._drop(count - offset)
+                    return
+            take = min(count - offset, self.block_rows - self._fill)
+            self._block[self._fill:self._fill + take] = rows[offset:offset + take]
+            self._fill += take
+            offset += take
+            if self._fill == self.block_rows:
+                self._hand_over()
+
+    def _drop(self, rows: int) -> None:
+        self.dropped_rows += rows
+        now = time.monotonic()
+        if now - self._drop_warned_at >= self.DROP_WARNING_INTERVAL:
+            self._drop_warned_at = now
+            logger.warning("SegmentWriter cannot keep up; dropping evicted rows "
+                           "({} dropped so far)", self.dropped_rows)
+
+    def _take_free_block(self) -> Optional[np.ndarray]:
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _hand_over(self) -> None:
+        self._pending.put((self._block, self._fill))
+        self._block = self._take_free_block()
+        self._fill = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Rows written and dropped so far, and blocks waiting to be written."""
+        return {
+            "written_rows": self.written_rows,
+            "dropped_rows": self.dropped_rows,
+            "pending_blocks": self._pending.qsize(),
+        }
+
+    def close(self) -> None:
+        """Write any partially filled block and stop the background thread."""
+        if self._block is not None and self._fill:
+            self._hand_over()
+        self._pending.put(None)
+        self._thread.join()
+        if self.dropped_rows:
+            logger.warning("SegmentWriter dropped {} evicted rows", self.dropped_rows)
+
+    # ------------------------------------------------------------------
+    # Consumer side (background thread)
+    # ------------------------------------------------------------------
+
+    def _next_segment_id(self) -> int:
+        existing = [name for name in os.listdir(self.directory)
+                    if name.startswith("segment_") and name.endswith(".npy")]
+        return len(existing)
+
+    def _segment_name(self) -> str:
+        return f"segment_{self._segment_id:06d}.npy"
+
+    def _seconds(self, timestamp) -> float:
+        if self.dtype["timestamp"].kind == "i":
+            return int(timestamp) / 1e9
+        return float(timestamp)
+
+    def _run(self) -> None:
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            block, rows = item
+            try:
+                self._write_chunk(block[:rows])
+            except Exception:
+                logger.exception("SegmentWriter failed to write {} rows", rows)
+            finally:
+                self._free.put(block)
+
+    def _write_chunk(self, chunk: np.ndarray) -> None:
+        if self._segment_fill >= self.segment_rows:
+            self._segment_id += 1
+            self._segment_fill = 0
+        name = self._segment_name()
+        with open(os.path.join(self.directory, name), "ab") as handle:
+            offset = handle.tell()
+            np.save(handle, chunk)
+        # min/max rather than first/last: a sink shared by the partitions of
+        # a PartitionedOrderFlowBuffer receives rows out of time order.
+        timestamps = chunk["timestamp"]
+        with open(os.path.join(self.directory, self.INDEX_NAME), "a") as index:
+            index.write(f"{name},{offset},{chunk.shape[0]},"
+                        f"{self._seconds(timestamps.min())!r},"
+                        f"{self._seconds(timestamps.max())!r}\n")
+        self._segment_fill += chunk.shape[0]
+        self.written_rows += chunk.shape[0]
+
+
+def _chunk_dtype(path: str, offset: int) -> np.dtype:
+    """Row dtype recorded in the ``.npy`` header of the chunk at ``offset``."""
+    with open(path, "rb") as handle:
+        handle.seek(offset)
+        version = np.lib.format.read_magic(handle)
+        if version == (1, 0):
+            return np.lib.format.read_array_header_1_0(handle)[2]
+        return np.lib.format.read_array_header_2_0(handle)[2]
+
+
+def load_segments(directory: str, t0: float = -math.inf,
+                  t1: float = math.inf, compact: bool = False) -> np.ndarray:
+    """
+    Read back spilled chunks whose time span overlaps ``[t0, t1]`` (rows are
+    returned as stored; compact rows still need ``OrderFlowBuffer.decode``).
+    An empty result has the dtype of the stored chunks, or, when nothing
+    has been spilled yet, the compact or default row layout per ``compact``.
+    """
+    chunks = []
+    dtype = OrderFlowBuffer.compact_dtype if compact else OrderFlowBuffer.dtype
+    index_path = os.path.join(directory, SegmentWriter.INDEX_NAME)
+    if not os.path.exists(index_path):
+        return np.empty(0, dtype=dtype)
+    with open(index_path) as index:
+        for line_number, line in enumerate(index):
+            name, offset, _rows, first, last = line.rstrip("\n").split(",")
+            path = os.path.join(directory, name)
+            if line_number == 0:
+                dtype = _chunk_dtype(path, int(offset))
+            if float(last) < t0 or float(first) > t1:
+                continue
+            with open(path, "rb") as handle:
+                handle.seek(int(offset))
+                chunks.append(np.load(handle))
+    if not chunks:
+        return np.empty(0, dtype=dtype)
+    rows = np.concatenate(chunks)
+    seconds = rows["timestamp"]
+    if seconds.dtype.kind == "i":
+        seconds = seconds / 1e9
+    return rows[(seconds >= t0) & (seconds <= t1)]
+
+
+class PartitionedOrderFlowBuffer:
+    """
+    One :class:`OrderFlowBuffer` ring per ticker id, created lazily on the
+    first tick. A busy stream only evicts its own history, and per-ticker
+    reads go straight to that ticker's ring instead of filtering a shared
+    table. ``capacities`` overrides ``default_capacity`` per ticker; when
+    ``directory`` is given each ring is memory-mapped to its own file, and
+    the ``ticker_<id>.ofb`` files already there are reopened (with the
+    capacity they were created with) so a restart sees their history.
+    """
+
+    dtype = OrderFlowBuffer.dtype
+
+    def __init__(self, default_capacity: int,
+                 capacities: Optional[Dict[int, int]] = None,
+                 directory: Optional[str] = None, profile: str = "default",
+                 price_scales: Optional[Dict[int, int]] = None,
+                 eviction_sink: Optional[SegmentWriter] = None):
+        if default_capacity <= 0:
+            raise ValueError("default_capacity must be positive")
+        self.default_capacity = default_capacity
+        self.capacities: Dict[int, int] = dict(capacities or {})
+        self.directory = directory
+        self.profile = profile
+        self.price_scales: Dict[int, int] = dict(price_scales or {})
+        self.eviction_sink = eviction_sink
+        self.partitions: Dict[int, OrderFlowBuffer] = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            for name in sorted(os.listdir(directory)):
+                ticker = name[len("ticker_"):-len(".ofb")]
+                if name.startswith("ticker_") and name.endswith(".ofb") and ticker.isdigit():
+                    self.partition(int(ticker))
+
+    def _path(self, ticker_id: int) -> Optional[str]:
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, f"ticker_{ticker_id}.ofb")
+
+    def partition(self, ticker_id: int) -> OrderFlowBuffer:
+        """Return the ring for ``ticker_id``, creating it on first use."""
+        buffer = self.partitions.get(ticker_id)
+        if buffer is None:
+            path = self._path(ticker_id)
+            capacity = self.capacities.get(ticker_id, self.default_capacity)
+            if path is not None and os.path.exists(path) and os.path.getsize(path) > 0:
+                header = np.fromfile(path, dtype=OrderFlowBuffer.header_dtype, count=1)
+                capacity = int(header["capacity"][0])
+            buffer = OrderFlowBuffer(
+                capacity, path=path, profile=self.profile, price_scales=self.price_scales,
+                eviction_sink=self.eviction_sink)
+            self.partitions[ticker_id] = buffer
+        return buffer
+
+    def subscribe(self, ticker_id: int, from_start: bool = False) -> BufferCursor:
+        """Cursor over one ticker's ring; see :meth:`OrderFlowBuffer.subscribe`."""
+        return self.partition(ticker_id).subscribe(from_start)
+
+    @property
+    def size(self) -> int:
+        return sum(buffer.size for buffer in self.partitions.values())
+
+    @property
+    def sequence(self) -> int:
+        return sum(buffer.sequence for buffer in self.partitions.values())
+
+    def append(self, ticker_id: int, tick_type: int, snapshot: Snapshot,
+               timestamp: Optional[float] = None) -> None:
+        self.partition(ticker_id).append(ticker_id, tick_type, snapshot, timestamp)
+
+    def append_many(self, timestamps, ticker_ids, tick_types, **fields) -> None:
+        """Route a batch to the per-ticker rings; see :meth:`OrderFlowBuffer.append_many`."""
+        timestamps = np.asarray(timestamps, dtype="float64")
+        count = timestamps.shape[0]
+        ids = np.asarray(ticker_ids)
+        if ids.ndim == 0:
+            self.partition(int(ids)).append_many(timestamps, ids, tick_types, **fields)
+            return
+        order = np.argsort(ids, kind="stable")
+        sorted_ids = ids[order]
+        bounds = np.flatnonzero(np.diff(sorted_ids)) + 1
+        columns = {name: values for name, values in fields.items() if values is not None}
+        columns["tick_types"] = tick_types
+        for group in np.split(order, bounds):
+            ticker_id = int(ids[group[0]])
+            picked = {
+                name: (np.broadcast_to(np.asarray(values), (count,))[group])
+                for name, values in columns.items()
+            }
+            self.partition(ticker_id).append_many(
+                timestamps[group], ticker_id, picked.pop("tick_types"), **picked)
+
+    def flush(self) -> None:
+        for buffer in self.partitions.values():
+            buffer.flush()
+
+    def to_array(self, ticker_id: Optional[int] = None) -> np.ndarray:
+        """
+        Rows for one ticker (O(rows of that ticker)), or the time-ordered
+        merge of every partition when ``ticker_id`` is None.
+        """
+        if ticker_id is not None:
+            buffer = self.partitions.get(ticker_id)
+            return buffer.to_array() if buffer else np.empty(0, dtype=self.dtype)
+        return self._merge([buffer.to_array() for buffer in self.partitions.values()])
+
+    def tail(self, n: int, ticker_id: Optional[int] = None) -> np.ndarray:
+        if ticker_id is not None:
+            buffer = self.partitions.get(ticker_id)
+            return buffer.tail(n) if buffer else np.empty(0, dtype=self.dtype)
+        merged = self._merge([buffer.tail(n) for buffer in self.partitions.values()])
+        return merged[-n:] if n > 0 else merged[:0]
+
+    def between(self, t0: float, t1: float,
+                ticker_id: Optional[int] = None) -> np.ndarray:
+        """Decoded rows with ``t0 <= timestamp <= t1``, merged across tickers."""
+        buffers = self._selected(ticker_id)
+        return self._merge([buffer.between(t0, t1) for buffer in buffers])
+
+    def since(self, t: float, ticker_id: Optional[int] = None) -> np.ndarray:
+        buffers = self._selected(ticker_id)
+        return self._merge([buffer.since(t) for buffer in buffers])
+
+    def _selected(self, ticker_id: Optional[int]) -> List[OrderFlowBuffer]:
+        if ticker_id is None:
+            return list(self.partitions.values())
+        buffer = self.partitions.get(ticker_id)
+        return [buffer] if buffer else []
+
+    def _merge(self, parts: List[np.ndarray]) -> np.ndarray:
+        # Every part is already time-ordered; a stable sort of the concatenation
+        # (timsort for float keys) only merges the k runs: O(N log k).
+        parts = [part for part in parts if part.size]
+        if not parts:
             return np.empty(0, dtype=self.dtype)
-        n = min(n, self.size)
-        indices = (self._write_idx - np.arange(1, n + 1)) % self.capacity
-        return self._data[indices][::-1].copy()
+        if len(parts) == 1:
+            return parts[0]
+        merged = np.concatenate(parts)
+        return merged[np.argsort(merged["timestamp"], kind="stable")]
 
 
-class SlidingHistogram:
+class OrderFlowEventLog:
     """
-    Maintains a sliding window histogram for trade volume per price bin.
+    Delta storage for the tick stream: each tick stores only
+    ``(timestamp, ticker_id, tick_type, value)`` (24 bytes instead of a
+    72-byte snapshot row). Every ``keyframe_interval`` events the full
+    per-ticker snapshot state is saved, so rebuilding the snapshot rows of
+    any range replays at most ``keyframe_interval`` extra events.
+
+    ``to_array``/``tail``/``between``/``since`` return rows in the
+    :class:`OrderFlowBuffer` layout, starting at the oldest keyframe still
+    covered by the ring.
     """
 
-    def __init__(self, window_seconds: float, bin_size: float, name: str):
-        self.window_seconds = window_seconds
-        self.bin_size = bin_size
+    dtype = OrderFlowBuffer.dtype
+    event_dtype = np.dtype([
+        ("timestamp", "float64"),
+        ("ticker_id", "int32"),
+        ("tick_type", "int32"),
+        ("value", "float64"),
+    ])
+    fields = ("bid_size", "bid_price", "ask_price", "ask_size",
+              "last_price", "last_size", "volume")
+    field_by_tick_type = {0: "bid_size", 1: "bid_price", 2: "ask_price",
+                          3: "ask_size", 4: "last_price", 5: "last_size",
+                          8: "volume"}
+
+    def __init__(self, capacity: int, keyframe_interval: int = 4096):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        if keyframe_interval <= 0:
+            raise ValueError("keyframe_interval must be positive")
+        self.capacity = capacity
+        self.keyframe_interval = min(keyframe_interval, capacity)
+        self._events = np.zeros(capacity, dtype=self.event_dtype)
+        self._write_idx = 0
+        self.size = 0
+        self.sequence = 0
+        # Column of each tick type in the snapshot field order; -1 = not stored.
+        self._column_by_tick_type = np.full(256, -1, dtype="int64")
+        for tick_type, name in self.field_by_tick_type.items():
+            self._column_by_tick_type[tick_type] = self.fields.index(name)
+        self._state: Dict[int, np.ndarray] = {}
+        # (sequence, state before that event) pairs, oldest first.
+        self._keyframes: deque[Tuple[int, Dict[int, np.ndarray]]] = deque()
+        logger.debug("OrderFlowEventLog initialized with capacity {} (keyframe every {})",
+                     capacity, keyframe_interval)
+
+    # ------------------------------------------------------------------
+    # Ingestion
+    # ------------------------------------------------------------------
+
+    def append(self, ticker_id: int, tick_type: int, snapshot: Snapshot,
+               timestamp: Optional[float] = None) -> None:
+        """Drop-in for :meth:`OrderFlowBuffer.append`: stores only the changed field."""
+        name = self.field_by_tick_type.get(tick_type)
+        value = getattr(snapshot, name) if name else np.nan
+        self.append_event(ticker_id, tick_type, value, timestamp)
+
+    def append_event(self, ticker_id: int, tick_type: int, value: float,
+                     timestamp: Optional[float] = None) -> None:
+        now = time.time() if timestamp is None else timestamp
+        if self.sequence % self.keyframe_interval == 0:
+            self._add_keyframe()
+        self._events[self._write_idx] = (now, ticker_id, tick_type, value)
+        column = self._column_by_tick_type[tick_type]
+        if column >= 0:
+            state = self._state.get(ticker_id)
+            if state is None:
+                state = self._state[ticker_id] = np.full(len(self.fields), np.nan)
+            state[column] = value
+        self._advance(1)
+
+    def append_many(self, timestamps, ticker_ids, tick_types, values) -> None:
+        """Append a batch of events, splitting it at keyframe boundaries."""
+        timestamps = np.asarray(timestamps, dtype="float64")
+        count = timestamps.shape[0]
+        ticker_ids = np.broadcast_to(np.asarray(ticker_ids, dtype="int32"), (count,))
+        tick_types = np.broadcast_to(np.asarray(tick_types, dtype="int32"), (count,))
+        values = np.broadcast_to(np.asarray(values, dtype="float64"), (count,))
+        lo = 0
+        while lo < count:
+            if self.sequence % self.keyframe_interval == 0:
+                self._add_keyframe()
+            hi = min(count, lo + self.keyframe_interval
+                     - self.sequence % self.keyframe_interval)
+            for ring_slice, src_slice in ring_slices(self._write_idx, hi - lo,
+                                                     self.capacity):
+                chunk = slice(lo + src_slice.start, lo + src_slice.stop)
+                self._events["timestamp"][ring_slice] = timestamps[chunk]
+                self._events["ticker_id"][ring_slice] = ticker_ids[chunk]
+                self._events["tick_type"][ring_slice] = tick_types[chunk]
+                self._events["value"][ring_slice] = values[chunk]
+            self._update_state(ticker_ids[lo:hi], tick_types[lo:hi], values[lo:hi])
+            self._advance(hi - lo)
+            lo = hi
+
+    def _advance(self, count: int) -> None:
+        self._write_idx = (self._write_idx + count) % self.capacity
+        self.size = min(self.capacity, self.size + count)
+        self.sequence += count
+        oldest = self.sequence - self.size
+        while self._keyframes and self._keyframes[0][0] < oldest:
+            self._keyframes.popleft()
+
+    def _add_keyframe(self) -> None:
+        frame = {ticker_id: state.copy() for ticker_id, state in self._state.items()}
+        self._keyframes.append((self.sequence, frame))
+
+    def _update_state(self, ticker_ids: np.ndarray, tick_types: np.ndarray,
+                      values: np.ndarray) -> None:
+        columns = self._column_by_tick_type[tick_types]
+        stored = columns >= 0
+        keys = ticker_ids[stored].astype("int64") * len(self.fields) + columns[stored]
+        if keys.size == 0:
+            return
+        # Last write wins: search the reversed batch for the first occurrence.
+        unique_keys, first_rev = np.unique(keys[::-1], return_index=True)
+        last_values = values[stored][::-1][first_rev]
+        for key, value in zip(unique_keys.tolist(), last_values.tolist()):
+            ticker_id, column = divmod(key, len(self.fields))
+            state = self._state.get(ticker_id)
+            if state is None:
+                state = self._state[ticker_id] = np.full(len(self.fields), np.nan)
+            state[column] = value
+
+    def flush(self) -> None:
+        """Event logs are memory-only; kept for interface parity."""
+
+    # ------------------------------------------------------------------
+    # Reconstruction
+    # ------------------------------------------------------------------
+
+    def _events_range(self, start: int, stop: int) -> np.ndarray:
+        """Copy the events with sequence numbers in ``[start, stop)``."""
+        count = stop - start
+        pairs = ring_slices(start % self.capacity, count, self.capacity)
+        if len(pairs) == 1:
+            return self._events[pairs[0][0]].copy()
+        return np.concatenate([self._events[ring_slice] for ring_slice, _ in pairs])
+
+    def rows(self, start: int, stop: int) -> np.ndarray:
+        """
+        Rebuild snapshot rows for the events with sequence numbers in
+        ``[start, stop)``, clipped to what the retained keyframes cover.
+        """
+        if not self._keyframes:
+            return np.empty(0, dtype=self.dtype)
+        stop = min(stop, self.sequence)
+        frame_seqs = [seq for seq, _frame in self._keyframes]
+        pos = bisect.bisect_right(frame_seqs, max(start, frame_seqs[0])) - 1
+        frame_seq, frame = self._keyframes[pos]
+        start = max(start, frame_seq)
+        if start >= stop:
+            return np.empty(0, dtype=self.dtype)
+
+        events = self._events_range(frame_seq, stop)
+        count = events.shape[0]
+        tickers = sorted(frame)
+        width = len(self.fields)
+        # Keyframe state goes in as one pseudo-event per ticker, ahead of the
+        # replayed events; forward-filling each column per ticker then yields
+        # the snapshot after every event.
+        ids = np.concatenate((np.asarray(tickers, dtype="int64"),
+                              events["ticker_id"].astype("int64")))
+        total = ids.shape[0]
+        vals = np.full((total, width), np.nan)
+        mask = np.zeros((total, width), dtype=bool)
+        if tickers:
+            vals[:len(tickers)] = np.stack([frame[t] for t in tickers])
+            mask[:len(tickers)] = True
+        columns = self._column_by_tick_type[events["tick_type"]]
+        stored = np.flatnonzero(columns >= 0)
+        vals[len(tickers) + stored, columns[stored]] = events["value"][stored]
+        mask[len(tickers) + stored, columns[stored]] = True
+
+        order = np.argsort(ids, kind="stable")
+        sorted_ids = ids[order]
+        group_start = np.ones(total, dtype=bool)
+        group_start[1:] = sorted_ids[1:] != sorted_ids[:-1]
+        positions = np.arange(total)
+        filled = np.empty((total, width))
+        for column in range(width):
+            src = np.where(mask[order, column] | group_start, positions, 0)
+            np.maximum.accumulate(src, out=src)
+            filled[order, column] = vals[order[src], column]
+
+        skip = start - frame_seq
+        out = np.empty(count - skip, dtype=self.dtype)
+        out["timestamp"] = events["timestamp"][skip:]
+        out["ticker_id"] = events["ticker_id"][skip:]
+        out["tick_type"] = events["tick_type"][skip:]
+        replayed = filled[len(tickers) + skip:]
+        for column, name in enumerate(self.fields):
+            out[name] = replayed[:, column]
+        return out
+
+    @property
+    def oldest_sequence(self) -> int:
+        """First sequence number that can still be rebuilt from a keyframe."""
+        return self._keyframes[0][0] if self._keyframes else self.sequence
+
+    def subscribe(self, from_start: bool = False) -> BufferCursor:
+        return BufferCursor(self, self.oldest_sequence if from_start else self.sequence)
+
+    def read_range(self, start: int, stop: Optional[int] = None) -> Tuple[np.ndarray, int]:
+        """Same contract as :meth:`OrderFlowBuffer.read_range`."""
+        stop = self.sequence if stop is None else min(stop, self.sequence)
+        rows = self.rows(start, stop)
+        return rows, max(start, stop - rows.shape[0])
+
+    def to_array(self) -> np.ndarray:
+        return self.rows(self.sequence - self.size, self.sequence)
+
+    def tail(self, n: int) -> np.ndarray:
+        if n <= 0:
+            return np.empty(0, dtype=self.dtype)
+        return self.rows(self.sequence - min(n, self.size), self.sequence)
+
+    def _sequence_at(self, timestamp: float, right: bool) -> int:
+        oldest = self.sequence - self.size
+        base = 0
+        for ring_slice, _src in ring_slices(oldest % self.capacity, self.size,
+                                            self.capacity):
+            stamps = self._events["timestamp"][ring_slice]
+            search = bisect.bisect_right if right else bisect.bisect_left
+            pos = search(stamps, timestamp)
+            if pos < len(stamps):
+                return oldest + base + pos
+            base += len(stamps)
+        return self.sequence
+
+    def between(self, t0: float, t1: float) -> np.ndarray:
+        """Snapshot rows with ``t0 <= timestamp <= t1``, found by binary search."""
+        return self.rows(self._sequence_at(t0, right=False),
+                         self._sequence_at(t1, right=True))
+
+    def since(self, t: float) -> np.ndarray:
+        return self.rows(self._sequence_at(t, right=False), self.sequence)
+
+
+class PriceBinArray:
+    """
+    Volume per integer price bin for one or more rows (horizons, sides...).
+
+    Column ``slot`` of ``volumes`` holds bin ``base + slot``. When a bin
+    falls outside the array it is re-centred (and resized) around the bins
+    that still hold volume, so lookups stay O(1) amortized.
+
+    A max segment tree per row answers point-of-control and top-N queries.
+    Writers only record changed slots in ``dirty``; the tree is brought up
+    to date on the next query with one vectorized pass per tree level, so
+    the tick path never walks the tree.
+    """
+
+    def __init__(self, rows: int, initial_bins: int, name: str):
         self.name = name
-        self.events: deque[Tuple[float, float, float]] = deque()
-        self.hist: Dict[float, float] = defaultdict(float)
+        self.initial_bins = initial_bins
+        self.volumes = np.zeros((rows, initial_bins), dtype="float64")
+        self.base: Optional[int] = None
+        self.dirty: set = set()
+        self._tree: Optional[np.ndarray] = None
+        self._leaves = 0
+
+    def slot(self, bin_index: int) -> int:
+        """Array column of ``bin_index``; may replace ``volumes``."""
+        if self.base is None:
+            self.base = bin_index - self.volumes.shape[1] // 2
+        slot = bin_index - self.base
+        if 0 <= slot < self.volumes.shape[1]:
+            return slot
+        self._recenter(bin_index, bin_index)
+        return bin_index - self.base
+
+    def slots(self, bins: np.ndarray) -> np.ndarray:
+        """Array columns of ``bins`` (a non-empty array); may replace ``volumes``."""
+        lo, hi = int(bins.min()), int(bins.max())
+        if self.base is None:
+            self.base = (lo + hi) // 2 - self.volumes.shape[1] // 2
+        if lo < self.base or hi - self.base >= self.volumes.shape[1]:
+            self._recenter(lo, hi)
+        return bins - self.base
+
+    def _recenter(self, lo: int, hi: int) -> None:
+        live = np.flatnonzero(self.volumes.any(axis=0))
+        if live.size:
+            lo = min(lo, self.base + int(live[0]))
+            hi = max(hi, self.base + int(live[-1]))
+        length = max(self.initial_bins, 2 * (hi - lo + 1))
+        base = (lo + hi) // 2 - length // 2
+        volumes = np.zeros((self.volumes.shape[0], length), dtype="float64")
+        if live.size:
+            first, last = int(live[0]), int(live[-1])
+            offset = self.base - base
+            volumes[:, first + offset:last + offset + 1] = self.volumes[:, first:last + 1]
+        logger.debug("{} re-centred: {} bins from {} (was {} from {})",
+                     self.name, length, base, self.volumes.shape[1], self.base)
+        self.volumes = volumes
+        self.base = base
+        self._tree = None
+        self.dirty.clear()
+
+    def reset(self, lo: Optional[int] = None, hi: Optional[int] = None) -> None:
+        """Clear every row; when given, size the array for bins ``lo..hi``."""
+        rows = self.volumes.shape[0]
+        if lo is None or hi is None:
+            self.volumes = np.zeros((rows, self.initial_bins), dtype="float64")
+            self.base = None
+        else:
+            length = max(self.initial_bins, 2 * (hi - lo + 1))
+            self.volumes = np.zeros((rows, length), dtype="float64")
+            self.base = (lo + hi) // 2 - length // 2
+        self._tree = None
+        self.dirty.clear()
 
-    def _bin_key(self, price: float) -> float:
+    # ------------------------------------------------------------------
+    # Segment tree
+    # ------------------------------------------------------------------
+
+    def _rebuild_tree(self) -> None:
+        rows, bins = self.volumes.shape
+        leaves = 1 << max(0, (bins - 1).bit_length())
+        tree = np.zeros((rows, 2 * leaves), dtype="float64")
+        tree[:, leaves:leaves + bins] = self.volumes
+        start = leaves
+        while start > 1:
+            half = start // 2
+            np.maximum(tree[:, start:2 * start:2], tree[:, start + 1:2 * start:2],
+                       out=tree[:, half:start])
+            start = half
+        self._tree = tree
+        self._leaves = leaves
+        self.dirty.clear()
+
+    def _refresh_tree(self) -> np.ndarray:
+        if self._tree is None:
+            self._rebuild_tree()
+        elif self.dirty:
+            nodes = np.fromiter(self.dirty, dtype="int64", count=len(self.dirty))
+            self.dirty.clear()
+            tree = self._tree
+            tree[:, nodes + self._leaves] = self.volumes[:, nodes]
+            nodes = nodes + self._leaves
+            while nodes[0] > 1:
+                nodes = np.unique(nodes >> 1)
+                tree[:, nodes] = np.maximum(tree[:, 2 * nodes], tree[:, 2 * nodes + 1])
+        return self._tree
+
+    def peak(self, row: int) -> Tuple[Optional[int], float]:
+        """Return ``(bin_index, volume)`` of the largest bin of ``row`` in O(log bins)."""
+        tree = self._refresh_tree()[row]
+        if self.base is None or tree[1] <= 0.0:
+            return None, 0.0
+        node = 1
+        while node < self._leaves:
+            node = 2 * node if tree[2 * node] >= tree[2 * node + 1] else 2 * node + 1
+        return self.base + node - self._leaves, float(tree[node])
+
+    def top(self, row: int, n: int) -> List[Tuple[int, float]]:
+        """
+        Return up to ``n`` ``(bin_index, volume)`` pairs of ``row`` by
+        descending volume, by best-first search of the tree: O(n log bins).
+        """
+        tree = self._refresh_tree()[row]
+        if self.base is None or n <= 0:
+            return []
+        leaves = self._leaves
+        heap = [(-float(tree[1]), 1)]
+        result: List[Tuple[int, float]] = []
+        while heap and len(result) < n:
+            neg_volume, node = heapq.heappop(heap)
+            if neg_volume >= 0.0:
+                break
+            if node >= leaves:
+                result.append((self.base + node - leaves, -neg_volume))
+                continue
+            left = 2 * node
+            heapq.heappush(heap, (-float(tree[left]), left))
+            heapq.heappush(heap, (-float(tree[left + 1]), left + 1))
+        return result
+
+    def nonzero(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(bin_indices, volumes)`` of the non-empty bins of ``row``."""
+        slots = np.flatnonzero(self.volumes[row])
+        if self.base is None or slots.size == 0:
+            return np.empty(0, dtype="int64"), np.empty(0)
+        return self.base + slots, self.volumes[row, slots]
+
+
+class PriceGrid:
+    """
+    Fixed-point price binning. Prices are integer ticks of ``1 / scale``
+    (100 for cent-priced stocks, 20 for a 0.05 minimum tick) and a bin is
+    ``bin_ticks`` whole ticks wide, so binning is an integer floor division
+    and two prices share a bin exactly when their ticks say so.
+    """
+
+    def __init__(self, bin_size: float, scale: int = 100):
+        if bin_size <= 0:
+            raise ValueError("bin_size must be positive")
+        if scale <= 0:
+            raise ValueError("scale must be positive")
+        self.scale = int(scale)
+        self.bin_ticks = max(1, round(bin_size * self.scale))
+        # Rounded to whole ticks, so it may differ from the requested size.
+        self.bin_size = self.bin_ticks / self.scale
+
+    def ticks(self, price: float) -> int:
+        """Integer ticks of ``price`` (``PRICE_NAN`` for NaN)."""
         if math.isnan(price):
-            raise ValueError("Price cannot be NaN for histogram binning")
-        return math.floor(price / self.bin_size) * self.bin_size
+            return PRICE_NAN
+        return round(price * self.scale)
+
+    def ticks_many(self, prices) -> np.ndarray:
+        prices = np.asarray(prices, dtype="float64")
+        nan_mask = np.isnan(prices)
+        ticks = np.rint(np.where(nan_mask, 0.0, prices * self.scale)).astype("int64")
+        ticks[nan_mask] = PRICE_NAN
+        return ticks
+
+    def bin_index(self, ticks):
+        """Bin of ``ticks`` (works element-wise on arrays)."""
+        return ticks // self.bin_ticks
+
+    def bin_price(self, bin_index):
+        """Lower edge of ``bin_index`` as a price (works element-wise on arrays)."""
+        return bin_index * self.bin_ticks / self.scale
+
+
+def window_trades(timestamps, prices, values, window_seconds: float,
+                  now: Optional[float] = None, grid: Optional[PriceGrid] = None
+                  ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, float]:
+    """
+    Prepare trade columns for a window rebuild: drop NaN and zero-volume
+    trades and those older than ``now - window_seconds`` (``now`` defaults
+    to the newest timestamp), and sort by time.
+
+    Returns ``(order, timestamps, bins, values, now)``, where ``order``
+    indexes the kept trades in the input and ``bins`` are their price bins.
+    """
+    timestamps = np.asarray(timestamps, dtype="float64")
+    prices = np.asarray(prices, dtype="float64")
+    values = np.asarray(values, dtype="float64")
+    valid = ~(np.isnan(prices) | np.isnan(values)) & (values != 0.0)
+    if now is None:
+        now = float(timestamps[valid].max()) if valid.any() else -math.inf
+    valid &= timestamps >= now - window_seconds
+    order = np.flatnonzero(valid)
+    order = order[np.argsort(timestamps[order], kind="stable")]
+    grid = grid or PriceGrid(1.0, 1)
+    bins = grid.bin_index(grid.ticks_many(prices[order]))
+    return order, timestamps[order], bins, values[order], now
+
+
+class TimeBucketedHistogram:
+    """
+    Trade-volume histogram whose window length is chosen at query time.
+
+    Trades go into a running ``total`` row over the last
+    ``max_window_seconds`` and into the open ``bucket_seconds`` bucket. When
+    a bucket closes its trades are summed into a delta of the distinct bins
+    it touched; once the bucket leaves the longest window that delta is
+    subtracted from the total, so expiry is one vector update per bucket
+    and never per trade. A shorter window is the total minus the deltas of
+    the buckets before it, or the sum of the buckets inside it when those
+    are fewer. Windows are rounded up to whole buckets.
+
+    Memory per instance is one float64 row covering the bins traded in the
+    window (at least ``initial_bins``: 2 KB at OrderFlowApp's 256) plus 16
+    bytes per distinct bin of every live bucket, e.g. about 60 KB for 360
+    buckets of 10 bins each. It follows the window's activity, not the
+    price range of the whole session.
+    """
+
+    def __init__(self, max_window_seconds: float, bin_size: float, name: str,
+                 bucket_seconds: float = 1.0, initial_bins: int = 1024,
+                 price_scale: int = 100):
+        if max_window_seconds <= 0 or bucket_seconds <= 0:
+            raise ValueError("window and bucket lengths must be positive")
+        self.grid = PriceGrid(bin_size, price_scale)
+        self.max_window_seconds = max_window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.bin_size = self.grid.bin_size
+        self.name = name
+        self.buckets = math.ceil(max_window_seconds / bucket_seconds)
+        # Row 0 is the running total of the live buckets.
+        self._bins = PriceBinArray(1, initial_bins, name)
+        # Closed buckets, oldest first: (bucket, bin indices, volumes).
+        self._closed: deque[Tuple[int, np.ndarray, np.ndarray]] = deque()
+        self._open_bins: List[int] = []
+        self._open_values: List[float] = []
+        self._bucket: Optional[int] = None
+
+    def advance(self, now: float) -> None:
+        """Close the open bucket and expire old ones as of ``now`` (also done by ``add``)."""
+        bucket = math.floor(now / self.bucket_seconds)
+        if self._bucket is None:
+            self._bucket = bucket
+            return
+        if bucket <= self._bucket:
+            return
+        if self._open_bins:
+            bins, inverse = np.unique(np.asarray(self._open_bins, dtype="int64"),
+                                      return_inverse=True)
+            self._closed.append((self._bucket, bins,
+                                 np.bincount(inverse, weights=self._open_values)))
+            self._open_bins = []
+            self._open_values = []
+        self._bucket = bucket
+        oldest = bucket - self.buckets + 1
+        total = self._bins.volumes[0]
+        while self._closed and self._closed[0][0] < oldest:
+            _bucket, bins, values = self._closed.popleft()
+            slots = bins - self._bins.base
+            remaining = total[slots] - values
+            remaining[np.abs(remaining) < 1e-9] = 0.0
+            total[slots] = remaining
 
     def add(self, timestamp: float, price: float, value: float) -> None:
-        if math.isnan(price) or math.isnan(value):
+        self.add_ticks(timestamp, self.grid.ticks(float(price)), value)
+
+    def add_ticks(self, timestamp: float, ticks: int, value: float) -> None:
+        """:meth:`add` for a price already converted to integer ticks."""
+        if ticks == PRICE_NAN or math.isnan(value):
             return
         if value == 0.0:
             return
-        bin_key = self._bin_key(float(price))
-        value_float = float(value)
-        self.events.append((timestamp, bin_key, value_float))
-        self.hist[bin_key] += value_float
+        self.advance(timestamp)
+        bin_index = ticks // self.grid.bin_ticks
+        value = float(value)
+        slot = self._bins.slot(bin_index)  # may replace the volume array
+        self._bins.volumes[0, slot] += value
+        self._open_bins.append(bin_index)
+        self._open_values.append(value)
+
+    def add_many(self, timestamps, ticks, values) -> None:
+        """Vectorized :meth:`add_ticks` of a time-ordered batch."""
+        ticks = np.asarray(ticks, dtype="int64")
+        values = np.asarray(values, dtype="float64")
+        keep = (ticks != PRICE_NAN) & ~np.isnan(values) & (values != 0.0)
+        if not keep.any():
+            return
+        timestamps = np.asarray(timestamps, dtype="float64")[keep]
+        bins = self.grid.bin_index(ticks[keep])
+        slots = self._bins.slots(bins)
+        values = values[keep]
+        # Buckets must close between trades of different buckets.
+        buckets = np.floor(timestamps / self.bucket_seconds)
+        bounds = np.flatnonzero(np.diff(buckets)) + 1
+        for start, stop in zip(np.r_[0, bounds], np.r_[bounds, timestamps.size]):
+            self.advance(float(timestamps[start]))
+            np.add.at(self._bins.volumes[0], slots[start:stop], values[start:stop])
+            self._open_bins.extend(bins[start:stop].tolist())
+            self._open_values.extend(values[start:stop].tolist())
+
+    def rebuild(self, timestamps, prices, values, now: Optional[float] = None) -> None:
+        """
+        Replace the profile with the given trades in one vectorized pass:
+        volumes are summed per (bucket, bin) with ``np.unique``/``np.bincount``
+        and split into the per-bucket deltas.
+        """
+        _order, ts, bins, vals, now = window_trades(
+            timestamps, prices, values, self.buckets * self.bucket_seconds,
+            now, self.grid)
+        self._closed = deque()
+        self._open_bins = []
+        self._open_values = []
+        self._bucket = None if math.isinf(now) else math.floor(now / self.bucket_seconds)
+        if not bins.size:
+            self._bins.reset()
+            return
+        current = self._bucket
+        first = current - self.buckets + 1
+        trade_buckets = np.floor(ts / self.bucket_seconds).astype("int64")
+        # Trades before the oldest bucket are outside every queryable window.
+        keep = trade_buckets >= first
+        trade_buckets = np.minimum(trade_buckets[keep], current)
+        bins, vals = bins[keep], vals[keep]
+        if not bins.size:
+            self._bins.reset()
+            return
+        self._bins.reset(int(bins.min()), int(bins.max()))
+        base = self._bins.base
+        length = self._bins.volumes.shape[1]
+        self._bins.volumes[0] = np.bincount(bins - base, weights=vals, minlength=length)
+
+        is_open = trade_buckets == current
+        self._open_bins = bins[is_open].tolist()
+        self._open_values = vals[is_open].tolist()
+        closed = ~is_open
+        codes, inverse = np.unique((trade_buckets[closed] - first) * length
+                                   + bins[closed] - base, return_inverse=True)
+        sums = np.bincount(inverse, weights=vals[closed])
+        code_buckets = codes // length + first
+        bounds = np.flatnonzero(np.diff(code_buckets)) + 1
+        for start, stop in zip(np.r_[0, bounds], np.r_[bounds, codes.size]):
+            if start < stop:
+                self._closed.append((int(code_buckets[start]),
+                                     codes[start:stop] % length + base,
+                                     sums[start:stop]))
+
+    def _window_volumes(self, window_seconds: float,
+                        now: Optional[float]) -> Optional[np.ndarray]:
+        if not 0 < window_seconds <= self.max_window_seconds:
+            raise ValueError(f"window must be in (0, {self.max_window_seconds}]")
+        if now is not None:
+            self.advance(now)
+        if self._bucket is None:
+            return None
+        first = self._bucket - math.ceil(window_seconds / self.bucket_seconds) + 1
+        closed = list(self._closed)
+        before = 0
+        for bucket, _bins, _values in closed:
+            if bucket >= first:
+                break
+            before += 1
+        total = self._bins.volumes[0]
+        if before <= len(closed) - before:
+            window = total.copy()
+            deltas = closed[:before]
+            sign = -1.0
+        else:
+            window = np.zeros_like(total)
+            deltas = closed[before:]
+            if self._open_bins:
+                deltas.append((self._bucket, np.asarray(self._open_bins, dtype="int64"),
+                               np.asarray(self._open_values)))
+            sign = 1.0
+        if deltas:
+            bins = np.concatenate([delta[1] for delta in deltas])
+            values = np.concatenate([delta[2] for delta in deltas])
+            np.add.at(window, bins - self._bins.base, sign * values)
+        window[np.abs(window) < 1e-9] = 0.0
+        return window
+
+    def volume_profile(self, window_seconds: float,
+                       now: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(prices, volumes)`` of the non-empty bins over the last window."""
+        window = self._window_volumes(window_seconds, now)
+        if window is None:
+            return np.empty(0), np.empty(0)
+        slots = np.flatnonzero(window)
+        return self.grid.bin_price(self._bins.base + slots), window[slots]
+
+    def top_bins(self, window_seconds: float, n: int = 5,
+                 now: Optional[float] = None) -> List[Tuple[float, float]]:
+        prices, volumes = self.volume_profile(window_seconds, now)
+        if n < volumes.shape[0]:
+            keep = np.argpartition(volumes, -n)[-n:]
+            prices, volumes = prices[keep], volumes[keep]
+        order = np.argsort(volumes, kind="stable")[::-1]
+        return list(zip(prices[order].tolist(), volumes[order].tolist()))
+
+
+class BookWindow:
+    """
+    Tracks the latest best bid/ask liquidity per price bin within a
+    sliding time window (level-1 order book).
+
+    Bins are keyed by the plain int ``bin_index * 2 + is_ask`` of their
+    :class:`PriceGrid` tick bin; ``snapshot`` translates keys back to
+    ``(side, price)``. ``latest`` maps each key to ``(timestamp, size,
+    version)``, where the
+    version is a per-update sequence number, so an update is never confused
+    with an older one that shares its timestamp. Expiry runs on a timing
+    wheel of ``wheel_slots`` buckets spanning the window: each live bin sits
+    in the bucket of its latest update and moves when it is updated, so
+    superseded updates are never stored, memory is bounded by the number of
+    live bins, and expiry clears whole buckets instead of individual events.
+    A bin becomes invisible to ``snapshot`` the moment it leaves the window
+    and is deleted once its bucket has fully expired.
+    """
+
+    def __init__(self, window_seconds: float, bin_size: float, name: str,
+                 wheel_slots: int = 256, price_scale: int = 100):
+        if window_seconds <= 0:
+            raise ValueError("window_seconds must be positive")
+        self.grid = PriceGrid(bin_size, price_scale)
+        self.window_seconds = window_seconds
+        self.bin_size = self.grid.bin_size
+        self.name = name
+        self.latest: Dict[int, Tuple[float, float, int]] = {}
+        self.version = 0
+        self.current_time = -math.inf
+        self._resolution = window_seconds / wheel_slots
+        # Two spare buckets so the bucket being filled never aliases one
+        # that is still live.
+        self._wheel: List[Dict[int, int]] = [{} for _ in range(wheel_slots + 2)]
+        self._slot_of: Dict[int, int] = {}
+        self._expired_through: Optional[int] = None
+
+    def _side_price(self, key: int) -> Tuple[str, float]:
+        return ("ask" if key & 1 else "bid", self.grid.bin_price(key >> 1))
+
+    def add(self, timestamp: float, side: str, price: float, size: float) -> None:
+        self.add_ticks(timestamp, side, self.grid.ticks(float(price)), size)
+
+    def add_ticks(self, timestamp: float, side: str, ticks: int, size: float) -> None:
+        """:meth:`add` for a price already converted to integer ticks."""
+        if ticks == PRICE_NAN or math.isnan(size):
+            return
+        if size < 0.0:
+            return
+        key = (ticks // self.grid.bin_ticks) * 2 + (side == "ask")
+        bucket = math.floor(timestamp / self._resolution)
+        if self._expired_through is None:
+            self._expired_through = bucket - 1
+        # Expire first: after a long gap the new bucket may alias one that
+        # has not been cleared yet.
         self._expire(timestamp)
+        self.version += 1
+        self.latest[key] = (timestamp, size, self.version)
+
+        # Late updates go to the oldest live bucket.
+        bucket = max(bucket, self._expired_through + 1)
+        slot = bucket % len(self._wheel)
+        previous = self._slot_of.get(key)
+        if previous != slot:
+            if previous is not None:
+                del self._wheel[previous][key]
+            self._slot_of[key] = slot
+        self._wheel[slot][key] = self.version
+
+    def expire(self, now: float) -> None:
+        """Drop events that left the window as of ``now`` (also done by ``add``)."""
+        self._expire(now)
+
+    def rebuild(self, timestamps, sides, prices, sizes,
+                now: Optional[float] = None) -> None:
+        """
+        Replace the window with the given quote updates. The latest update
+        of every bin is found with one ``np.unique`` pass; only bins still
+        inside the window are inserted.
+        """
+        timestamps = np.asarray(timestamps, dtype="float64")
+        prices = np.asarray(prices, dtype="float64")
+        sizes = np.asarray(sizes, dtype="float64")
+        is_ask = np.asarray(sides) == "ask"
+        valid = ~(np.isnan(prices) | np.isnan(sizes)) & (sizes >= 0.0)
+        order = np.flatnonzero(valid)
+        order = order[np.argsort(timestamps[order], kind="stable")]
+        if now is None:
+            now = float(timestamps[order[-1]]) if order.size else -math.inf
+
+        self.latest = {}
+        self._slot_of = {}
+        for wheel_slot in self._wheel:
+            wheel_slot.clear()
+        self.version = 0
+        self.current_time = now
+        self._expired_through = None
+        if math.isinf(now):
+            return
+        self._expired_through = math.floor(
+            (now - self.window_seconds) / self._resolution) - 1
+
+        bins = self.grid.bin_index(self.grid.ticks_many(prices[order]))
+        codes = bins * 2 + is_ask[order]
+        # Last update per bin: first occurrence in the reversed sequence.
+        _codes, first = np.unique(codes[::-1], return_index=True)
+        last = np.sort(order.size - 1 - first)
+        last = last[timestamps[order[last]] >= now - self.window_seconds]
+        for ts, key, size in zip(timestamps[order[last]].tolist(),
+                                 codes[last].tolist(), sizes[order[last]].tolist()):
+            self.version += 1
+            self.latest[key] = (ts, size, self.version)
+            slot = math.floor(ts / self._resolution) % len(self._wheel)
+            self._slot_of[key] = slot
+            self._wheel[slot][key] = self.version
 
     def _expire(self, current_time: float) -> None:
-        threshold = current_time - self.window_seconds
-        while self.events and self.events[0][0] < threshold:
-            ts, bin_key, val = self.events.popleft()
-            self.hist[bin_key] -= val
-            if abs(self.hist[bin_key]) < 1e-9:
-                del self.hist[bin_key]
+        self.current_time = max(self.current_time, current_time)
+        if self._expired_through is None:
+            return
+        # Bucket b covers [b, b + 1) * resolution and expires once it lies
+        # entirely before the window.
+        threshold = self.current_time - self.window_seconds
+        target = math.floor(threshold / self._resolution) - 1
+        start = max(self._expired_through + 1, target - len(self._wheel) + 1)
+        for bucket in range(start, target + 1):
+            wheel_slot = self._wheel[bucket % len(self._wheel)]
+            for key, version in wheel_slot.items():
+                entry = self.latest.get(key)
+                if entry is not None and entry[2] == version:
+                    del self.latest[key]
+                    del self._slot_of[key]
+            wheel_slot.clear()
+        self._expired_through = max(self._expired_through, target)
+
+    def snapshot(self, window_seconds: Optional[float] = None
+                 ) -> Dict[Tuple[str, float], float]:
+        """Latest size per bin updated within ``window_seconds`` (default: the full window)."""
+        window = self.window_seconds if window_seconds is None else window_seconds
+        threshold = self.current_time - window
+        return {self._side_price(key): size
+                for key, (ts, size, _version) in self.latest.items() if ts >= threshold}
+
+
+class HorizonView:
+    """
+    Read-only view of one horizon of a :class:`MultiHorizonHistogram` or
+    :class:`MultiHorizonBook`, exposing the single-window interface
+    (``name``, ``window_seconds``, ``snapshot()``, ``top_bins()``).
+    """
+
+    def __init__(self, parent, horizon: str):
+        self.parent = parent
+        self.horizon = horizon
+        self.name = f"{parent.name}_{horizon}"
 
-    def snapshot(self) -> Dict[float, float]:
-        return dict(self.hist)
+    @property
+    def window_seconds(self) -> float:
+        return self.parent.horizons[self.horizon]
+
+    def snapshot(self):
+        return self.parent.snapshot(self.horizon)
 
     def top_bins(self, n: int = 5) -> List[Tuple[float, float]]:
-        return sorted(self.hist.items(), key=lambda item: item[1], reverse=True)[:n]
+        return self.parent.top_bins(self.horizon, n)
 
+    def point_of_control(self):
+        return self.parent.point_of_control(self.horizon)
 
-class BookWindow:
+
+class MultiHorizonHistogram:
     """
-    Tracks the latest best bid/ask liquidity per price bin within a
-    sliding time window (level-1 order book).
+    Trade-volume histograms for several window lengths fed from one shared,
+    time-ordered event log.
+
+    Each trade is stored once; every horizon keeps its own expiry cursor
+    into the log and its own row of a :class:`PriceBinArray`. Adding a
+    trade updates all horizons with one vectorized column add, and events
+    are released once the slowest horizon has expired them, so memory and
+    per-tick work barely change when horizons are added.
     """
 
-    def __init__(self, window_seconds: float, bin_size: float, name: str):
-        self.window_seconds = window_seconds
-        self.bin_size = bin_size
+    # Event columns moved together by _make_room.
+    COLUMNS: Tuple[str, ...] = ("_ts", "_bin", "_val")
+    # Rows of the bin array per horizon.
+    ROW_GROUPS = 1
+
+    def __init__(self, horizons: Dict[str, float], bin_size: float, name: str,
+                 initial_bins: int = 1024, initial_events: int = 4096,
+                 price_scale: int = 100):
+        if not horizons:
+            raise ValueError("at least one horizon is required")
+        self.grid = PriceGrid(bin_size, price_scale)
+        self.horizons = dict(horizons)
+        self.bin_size = self.grid.bin_size
         self.name = name
-        self.events: deque[Tuple[float, Tuple[str, float], float]] = deque()
-        self.latest: Dict[Tuple[str, float], Tuple[float, float]] = {}
+        self._rows = {horizon: row for row, horizon in enumerate(self.horizons)}
+        self._windows = [float(seconds) for seconds in self.horizons.values()]
+        self._bins = PriceBinArray(len(self.horizons) * self.ROW_GROUPS,
+                                   initial_bins, name)
+        self._ts = np.empty(initial_events, dtype="float64")
+        self._bin = np.empty(initial_events, dtype="int64")
+        self._val = np.empty(initial_events, dtype="float64")
+        self._head = 0
+        self._tail = 0
+        # Per horizon: index of its oldest unexpired event.
+        self._cursors = [0] * len(self.horizons)
+
+    def window(self, horizon: str) -> HorizonView:
+        return HorizonView(self, horizon)
+
+    def _make_room(self, extra: int = 1) -> None:
+        """Compact the live events to the front, growing the log if needed."""
+        live = self._tail - self._head
+        capacity = self._ts.shape[0]
+        while (live + extra - 1) * 2 > capacity:
+            capacity *= 2
+        for name in self.COLUMNS:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:live] = old[self._head:self._tail]
+            setattr(self, name, new)
+        self._cursors = [cursor - self._head for cursor in self._cursors]
+        self._head = 0
+        self._tail = live
 
-    def _bin_key(self, price: float) -> float:
-        if math.isnan(price):
-            raise ValueError("Price cannot be NaN for book binning")
-        return math.floor(price / self.bin_size) * self.bin_size
+    def add(self, timestamp: float, price: float, value: float) -> None:
+        self.add_ticks(timestamp, self.grid.ticks(float(price)), value)
 
-    def add(self, timestamp: float, side: str, price: float, size: float) -> None:
-        if math.isnan(price) or math.isnan(size):
+    def add_ticks(self, timestamp: float, ticks: int, value: float) -> None:
+        """:meth:`add` for a price already converted to integer ticks."""
+        if ticks == PRICE_NAN or math.isnan(value):
             return
-        if size < 0.0:
+        if value == 0.0:
             return
-        bin_key = self._bin_key(float(price))
-        key = (side, bin_key)
-        self.events.append((timestamp, key, size))
-        self.latest[key] = (timestamp, size)
+        bin_index = ticks // self.grid.bin_ticks
+        value_float = float(value)
+        slot = self._push(timestamp, bin_index, value_float)
+        self._bins.volumes[:len(self._windows), slot] += value_float
+        self._bins.dirty.add(slot)
         self._expire(timestamp)
 
+    def add_many(self, timestamps, ticks, values) -> None:
+        """Vectorized :meth:`add_ticks` of a time-ordered batch."""
+        pushed = self._push_many(timestamps, ticks, values)
+        if pushed is not None:
+            slots, vals, _keep = pushed
+            self._add_columns(0, slots, vals)
+            self._expire(float(self._ts[self._tail - 1]))
+
+    def _push_many(self, timestamps, ticks, values
+                   ) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Append a batch to the log; returns ``(slots, values, kept mask)``."""
+        ticks = np.asarray(ticks, dtype="int64")
+        values = np.asarray(values, dtype="float64")
+        keep = (ticks != PRICE_NAN) & ~np.isnan(values) & (values != 0.0)
+        count = int(keep.sum())
+        if count == 0:
+            return None
+        if self._tail + count > self._ts.shape[0]:
+            self._make_room(count)
+        tail = self._tail
+        bins = self.grid.bin_index(ticks[keep])
+        vals = values[keep]
+        self._ts[tail:tail + count] = np.asarray(timestamps, dtype="float64")[keep]
+        self._bin[tail:tail + count] = bins
+        self._val[tail:tail + count] = vals
+        self._tail = tail + count
+        return self._bins.slots(bins), vals, keep
+
+    def _add_columns(self, first_row: int, slots: np.ndarray, values: np.ndarray) -> None:
+        """Add per-slot sums of ``values`` to the horizon rows starting at ``first_row``."""
+        lo = int(slots.min())
+        sums = np.bincount(slots - lo, weights=values)
+        count = len(self._windows)
+        self._bins.volumes[first_row:first_row + count, lo:lo + sums.size] += sums
+        self._bins.dirty.update((np.flatnonzero(sums) + lo).tolist())
+
+    def _push(self, timestamp: float, bin_index: int, value: float) -> int:
+        """Append one event to the log and return the slot of its bin."""
+        if self._tail == self._ts.shape[0]:
+            self._make_room()
+        tail = self._tail
+        self._ts[tail] = timestamp
+        self._bin[tail] = bin_index
+        self._val[tail] = value
+        self._tail = tail + 1
+        return self._bins.slot(bin_index)  # may replace the volume array
+
+    def rebuild(self, timestamps, prices, values, now: Optional[float] = None) -> None:
+        """Replace every horizon with the given trades in one vectorized pass."""
+        self._load(timestamps, prices, values, now)
+        self._fill_rows()
+
+    def _load(self, timestamps, prices, values, now: Optional[float]) -> np.ndarray:
+        """Refill the event log; returns the input index of every kept trade."""
+        order, ts, bins, vals, now = window_trades(
+            timestamps, prices, values, max(self._windows), now, self.grid)
+        count = order.size
+        capacity = self._ts.shape[0]
+        while capacity < count:
+            capacity *= 2
+        for name in self.COLUMNS:
+            setattr(self, name, np.zeros(capacity, dtype=getattr(self, name).dtype))
+        self._ts[:count] = ts
+        self._bin[:count] = bins
+        self._val[:count] = vals
+        self._head = 0
+        self._tail = count
+        self._cursors = [int(np.searchsorted(ts, now - window))
+                         for window in self._windows]
+        self._head = min(self._cursors)
+        if count:
+            self._bins.reset(int(bins.min()), int(bins.max()))
+        else:
+            self._bins.reset()
+        return order
+
+    def _fill_rows(self) -> None:
+        if self._bins.base is None:
+            return
+        volumes = self._bins.volumes
+        slots = self._bin[:self._tail] - self._bins.base
+        for row, cursor in enumerate(self._cursors):
+            volumes[row] = np.bincount(slots[cursor:], weights=self._val[cursor:self._tail],
+                                       minlength=volumes.shape[1])
+
+    def expire(self, now: float) -> None:
+        """Drop events that left the window as of ``now`` (also done by ``add``)."""
+        self._expire(now)
+
     def _expire(self, current_time: float) -> None:
-        threshold = current_time - self.window_seconds
-        while self.events and self.events[0][0] < threshold:
-            ts, key, _size = self.events.popleft()
-            latest_entry = self.latest.get(key)
-            if latest_entry and latest_entry[0] == ts:
-                del self.latest[key]
+        tail = self._tail
+        for row, window in enumerate(self._windows):
+            cursor = self._cursors[row]
+            threshold = current_time - window
+            if cursor >= tail or self._ts[cursor] >= threshold:
+                continue
+            stop = cursor + int(np.searchsorted(self._ts[cursor:tail], threshold))
+            self._release(row, cursor, stop)
+            self._cursors[row] = stop
+        self._head = min(self._cursors)
+
+    def _release(self, row: int, cursor: int, stop: int) -> None:
+        """Remove events ``cursor:stop`` from horizon ``row``."""
+        if stop - cursor == 1:
+            self._subtract_one(row, int(self._bin[cursor]), float(self._val[cursor]))
+        else:
+            self._subtract_many(row, self._bin[cursor:stop], self._val[cursor:stop])
+
+    def _subtract_one(self, row: int, bin_index: int, value: float) -> None:
+        volumes = self._bins.volumes
+        slot = bin_index - self._bins.base
+        remaining = volumes[row, slot] - value
+        volumes[row, slot] = 0.0 if abs(remaining) < 1e-9 else remaining
+        self._bins.dirty.add(slot)
+
+    def _subtract_many(self, row: int, bins: np.ndarray, values: np.ndarray) -> None:
+        volumes = self._bins.volumes
+        slots = bins - self._bins.base
+        np.subtract.at(volumes[row], slots, values)
+        touched = volumes[row, slots]
+        volumes[row, slots[np.abs(touched) < 1e-9]] = 0.0
+        self._bins.dirty.update(slots.tolist())
+
+    def bin_price(self, bin_index) -> float:
+        return self.grid.bin_price(bin_index)
+
+    def snapshot(self, horizon: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(prices, volumes)`` of the non-empty bins of ``horizon``."""
+        bins, volumes = self._bins.nonzero(self._rows[horizon])
+        return self.bin_price(bins), volumes
+
+    def point_of_control(self, horizon: str) -> Optional[Tuple[float, float]]:
+        bin_index, volume = self._bins.peak(self._rows[horizon])
+        if bin_index is None:
+            return None
+        return float(self.bin_price(bin_index)), volume
+
+    def top_bins(self, horizon: str, n: int = 5) -> List[Tuple[float, float]]:
+        return [(float(self.bin_price(bin_index)), volume)
+                for bin_index, volume in self._bins.top(self._rows[horizon], n)]
+
+
+class TradeClassifier:
+    """
+    Aggressor side of trades by the quote rule with a tick-rule fallback.
+
+    A trade above the prevailing mid-quote is buyer-initiated and one below
+    it seller-initiated. Trades at the mid, or without a valid quote, take
+    the direction of the last price change (an uptick buys, a downtick
+    sells, a zero tick repeats the previous side). Prices may be floats or
+    integer ticks; a missing quote is NaN or ``PRICE_NAN``.
+    """
+
+    BUY = 1
+    SELL = -1
+    UNKNOWN = 0
+
+    def __init__(self):
+        self.last_price = math.nan
+        self.last_tick = self.UNKNOWN
+
+    def classify(self, price: float, bid: float, ask: float) -> int:
+        if price > self.last_price:
+            self.last_tick = self.BUY
+        elif price < self.last_price:
+            self.last_tick = self.SELL
+        self.last_price = price
+        # Missing quotes (NaN or the negative PRICE_NAN) fail this test and
+        # fall through to the tick rule.
+        if 0.0 < bid <= ask:
+            mid = (bid + ask) / 2.0
+            if price > mid:
+                return self.BUY
+            if price < mid:
+                return self.SELL
+        return self.last_tick
+
+    def classify_many(self, prices, bids, asks) -> np.ndarray:
+        """Vectorized :meth:`classify` of a time-ordered trade sequence."""
+        prices = np.asarray(prices, dtype="float64")
+        if prices.size == 0:
+            return np.zeros(0, dtype="int8")
+        bids = np.asarray(bids, dtype="float64")
+        asks = np.asarray(asks, dtype="float64")
+        # Tick rule: sign of the last non-zero price change up to each trade.
+        changes = np.sign(np.diff(prices, prepend=self.last_price))
+        changes[np.isnan(changes)] = 0
+        last_change = np.maximum.accumulate(
+            np.where(changes != 0, np.arange(prices.size), -1))
+        ticks = np.where(last_change >= 0, changes[np.maximum(last_change, 0)],
+                         self.last_tick)
+        with np.errstate(invalid="ignore"):
+            quoted = (bids > 0.0) & (bids <= asks)
+            quote_sides = np.where(quoted, np.sign(prices - (bids + asks) / 2.0), 0)
+        self.last_price = prices[-1].item()
+        self.last_tick = int(ticks[-1])
+        return np.where(quote_sides != 0, quote_sides, ticks).astype("int8")
+
+
+class MultiHorizonFootprint(MultiHorizonHistogram):
+    """
+    :class:`MultiHorizonHistogram` that also splits volume by aggressor side.
+
+    The bin array holds total, buy and sell rows for every horizon, and the
+    cumulative volume delta (buy minus sell volume) of each horizon is kept
+    as a running sum that add and expiry adjust, so footprint, delta and
+    CVD queries need no pass over the event log. Trades of unknown side
+    only count towards the total.
+    """
+
+    COLUMNS = MultiHorizonHistogram.COLUMNS + ("_side",)
+    ROW_GROUPS = 3
+
+    def __init__(self, horizons: Dict[str, float], bin_size: float, name: str,
+                 initial_bins: int = 1024, initial_events: int = 4096,
+                 price_scale: int = 100):
+        super().__init__(horizons, bin_size, name, initial_bins, initial_events,
+                         price_scale)
+        self._side = np.zeros(initial_events, dtype="int8")
+        self._cvd = np.zeros(len(self.horizons), dtype="float64")
+        self.session_cvd = 0.0
+
+    def _side_row(self, row: int, side: int) -> int:
+        count = len(self._windows)
+        return row + (count if side == TradeClassifier.BUY else 2 * count)
+
+    def add(self, timestamp: float, price: float, value: float,
+            side: int = TradeClassifier.UNKNOWN) -> None:
+        self.add_ticks(timestamp, self.grid.ticks(float(price)), value, side)
+
+    def add_ticks(self, timestamp: float, ticks: int, value: float,
+                  side: int = TradeClassifier.UNKNOWN) -> None:
+        if ticks == PRICE_NAN or math.isnan(value):
+            return
+        if value == 0.0:
+            return
+        bin_index = ticks // self.grid.bin_ticks
+        value_float = float(value)
+        slot = self._push(timestamp, bin_index, value_float)
+        self._side[self._tail - 1] = side
+        count = len(self._windows)
+        volumes = self._bins.volumes
+        volumes[:count, slot] += value_float
+        if side != TradeClassifier.UNKNOWN:
+            first = self._side_row(0, side)
+            volumes[first:first + count, slot] += value_float
+            self._cvd += side * value_float
+            self.session_cvd += side * value_float
+        self._bins.dirty.add(slot)
+        self._expire(timestamp)
+
+    def add_many(self, timestamps, ticks, values, sides=None) -> None:
+        """Vectorized :meth:`add_ticks` of a time-ordered batch."""
+        pushed = self._push_many(timestamps, ticks, values)
+        if pushed is None:
+            return
+        slots, vals, keep = pushed
+        tail = self._tail
+        if sides is None:
+            sides = np.zeros(vals.size, dtype="int8")
+        else:
+            sides = np.asarray(sides, dtype="int8")[keep]
+        self._side[tail - vals.size:tail] = sides
+        self._add_columns(0, slots, vals)
+        for side in (TradeClassifier.BUY, TradeClassifier.SELL):
+            picked = sides == side
+            if picked.any():
+                self._add_columns(self._side_row(0, side), slots[picked], vals[picked])
+        delta = float((sides * vals).sum())
+        self._cvd += delta
+        self.session_cvd += delta
+        self._expire(float(self._ts[tail - 1]))
+
+    def rebuild(self, timestamps, prices, values, sides=None,
+                now: Optional[float] = None) -> None:
+        """
+        Replace every horizon with the given trades; ``sides`` holds the
+        :class:`TradeClassifier` side of each trade (unknown when omitted).
+        """
+        order = self._load(timestamps, prices, values, now)
+        if sides is not None:
+            self._side[:order.size] = np.asarray(sides, dtype="int8")[order]
+        self._cvd[:] = 0.0
+        self.session_cvd = 0.0
+        self._fill_rows()
+
+    def _fill_rows(self) -> None:
+        super()._fill_rows()
+        if self._bins.base is None:
+            return
+        volumes = self._bins.volumes
+        tail = self._tail
+        slots = self._bin[:tail] - self._bins.base
+        sides = self._side[:tail]
+        signed = sides * self._val[:tail]
+        for row, cursor in enumerate(self._cursors):
+            for side in (TradeClassifier.BUY, TradeClassifier.SELL):
+                weights = np.where(sides[cursor:] == side, self._val[cursor:tail], 0.0)
+                volumes[self._side_row(row, side)] = np.bincount(
+                    slots[cursor:], weights=weights, minlength=volumes.shape[1])
+            self._cvd[row] = signed[cursor:].sum()
+        self.session_cvd = float(signed.sum())
+
+    def _release(self, row: int, cursor: int, stop: int) -> None:
+        super()._release(row, cursor, stop)
+        if stop - cursor == 1:
+            side = int(self._side[cursor])
+            if side != TradeClassifier.UNKNOWN:
+                value = float(self._val[cursor])
+                self._subtract_one(self._side_row(row, side), int(self._bin[cursor]), value)
+                self._cvd[row] -= side * value
+            return
+        sides = self._side[cursor:stop]
+        for side in (TradeClassifier.BUY, TradeClassifier.SELL):
+            picked = np.flatnonzero(sides == side) + cursor
+            if picked.size:
+                values = self._val[picked]
+                self._subtract_many(self._side_row(row, side), self._bin[picked], values)
+                self._cvd[row] -= side * float(values.sum())
+
+    def cvd(self, horizon: str) -> float:
+        """Buy minus sell volume traded within ``horizon``."""
+        value = float(self._cvd[self._rows[horizon]])
+        return 0.0 if abs(value) < 1e-9 else value
+
+    def footprint(self, horizon: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return ``(prices, buy_volumes, sell_volumes)`` of the traded bins of ``horizon``."""
+        row = self._rows[horizon]
+        slots = np.flatnonzero(self._bins.volumes[row])
+        if slots.size == 0:
+            return np.empty(0), np.empty(0), np.empty(0)
+        volumes = self._bins.volumes
+        buy = volumes[self._side_row(row, TradeClassifier.BUY), slots]
+        sell = volumes[self._side_row(row, TradeClassifier.SELL), slots]
+        return self.bin_price(self._bins.base + slots), buy, sell
+
+    def delta(self, horizon: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(prices, buy - sell)`` of the traded bins of ``horizon``."""
+        prices, buy, sell = self.footprint(horizon)
+        return prices, buy - sell
+
+    def top_buy_bins(self, horizon: str, n: int = 5) -> List[Tuple[float, float]]:
+        row = self._side_row(self._rows[horizon], TradeClassifier.BUY)
+        return [(float(self.bin_price(bin_index)), volume)
+                for bin_index, volume in self._bins.top(row, n)]
+
+    def top_sell_bins(self, horizon: str, n: int = 5) -> List[Tuple[float, float]]:
+        row = self._side_row(self._rows[horizon], TradeClassifier.SELL)
+        return [(float(self.bin_price(bin_index)), volume)
+                for bin_index, volume in self._bins.top(row, n)]
+
+
+class MultiHorizonBook:
+    """
+    Best bid/ask liquidity for several window lengths. A bin's latest size
+    is the same for every horizon, only its visibility differs, so one
+    :class:`BookWindow` sized for the slowest horizon is kept and shorter
+    horizons filter it by the timestamp of the latest update.
+
+    While ``depth`` is set, snapshots are read straight from that
+    :class:`DepthBook` (levels updated within the horizon, summed per bin)
+    and the level-1 window is bypassed.
+    """
+
+    def __init__(self, horizons: Dict[str, float], bin_size: float, name: str,
+                 price_scale: int = 100):
+        if not horizons:
+            raise ValueError("at least one horizon is required")
+        self.horizons = dict(horizons)
+        self.name = name
+        self._book = BookWindow(max(self.horizons.values()), bin_size, name,
+                                price_scale=price_scale)
+        self.bin_size = self._book.bin_size
+        self.current_time = -math.inf
+        self.depth: Optional[DepthBook] = None
+
+    def window(self, horizon: str) -> HorizonView:
+        return HorizonView(self, horizon)
+
+    def add(self, timestamp: float, side: str, price: float, size: float) -> None:
+        self._book.add(timestamp, side, price, size)
+        self.current_time = self._book.current_time
+
+    def add_ticks(self, timestamp: float, side: str, ticks: int, size: float) -> None:
+        self._book.add_ticks(timestamp, side, ticks, size)
+        self.current_time = self._book.current_time
+
+    def add_depth(self, timestamp: float, position: int, operation: int, side: int,
+                  ticks: int, size: float) -> None:
+        """Apply one level-2 update to ``depth``; the windows are not touched."""
+        self.depth.update(position, operation, side, ticks, size, timestamp)
+        self.current_time = max(self.current_time, timestamp)
+
+    def expire(self, now: float) -> None:
+        self._book.expire(now)
+        self.current_time = max(self.current_time, self._book.current_time)
+
+    def rebuild(self, timestamps, sides, prices, sizes,
+                now: Optional[float] = None) -> None:
+        self._book.rebuild(timestamps, sides, prices, sizes, now)
+        self.current_time = self._book.current_time
+
+    def snapshot(self, horizon: str) -> Dict[Tuple[str, float], float]:
+        window = self.horizons[horizon]
+        if self.depth is not None:
+            return self.depth.snapshot(self.current_time - window)
+        return self._book.snapshot(window)
+
+    def top_bins(self, horizon: str, n: int = 5) -> List[Tuple[Tuple[str, float], float]]:
+        snapshot = self.snapshot(horizon)
+        return heapq.nlargest(n, snapshot.items(), key=lambda item: item[1])
+
+    def point_of_control(self, horizon: str) -> Optional[Tuple[Tuple[str, float], float]]:
+        top = self.top_bins(horizon, 1)
+        return top[0] if top else None
+
+
+class DepthBook:
+    """
+    Level-2 order book of one instrument in preallocated arrays: per side
+    (row 0 asks, row 1 bids, as IB's ``side`` codes) the :class:`PriceGrid`
+    ticks and sizes of up to ``max_rows`` levels in IB's position order,
+    best level first.
+
+    ``updateMktDepth`` addresses levels by position. An update overwrites
+    one row in place; an insert or delete shifts the rows below it with a
+    single slice copy of at most ``max_rows`` entries (the fixed depth
+    requested with ``reqMktDepth``), so every operation is constant-bounded
+    and nothing is allocated per update. ``stamps`` holds the time of each
+    level's last update and moves with it; :meth:`snapshot` sums the
+    levels per bin only when a reader asks.
+    """
+
+    SIDES = ("ask", "bid")
+    INSERT, UPDATE, DELETE = 0, 1, 2
+
+    def __init__(self, grid: PriceGrid, max_rows: int = 10):
+        if max_rows <= 0:
+            raise ValueError("max_rows must be positive")
+        self.grid = grid
+        self.max_rows = max_rows
+        self.ticks = np.full((2, max_rows), PRICE_NAN, dtype="int64")
+        self.sizes = np.zeros((2, max_rows), dtype="float64")
+        self.stamps = np.full((2, max_rows), -math.inf)
+        self.counts = [0, 0]
+
+    def update(self, position: int, operation: int, side: int, ticks: int,
+               size: float, timestamp: float = -math.inf) -> None:
+        """Apply one depth update (IB ``operation`` and ``side`` codes)."""
+        if not 0 <= position < self.max_rows or side not in (0, 1):
+            return
+        row_ticks = self.ticks[side]
+        row_sizes = self.sizes[side]
+        row_stamps = self.stamps[side]
+        count = self.counts[side]
+
+        if operation == self.DELETE:
+            if position >= count:
+                return
+            row_ticks[position:count - 1] = row_ticks[position + 1:count]
+            row_sizes[position:count - 1] = row_sizes[position + 1:count]
+            row_stamps[position:count - 1] = row_stamps[position + 1:count]
+            row_ticks[count - 1] = PRICE_NAN
+            row_sizes[count - 1] = 0.0
+            row_stamps[count - 1] = -math.inf
+            self.counts[side] = count - 1
+            return
+
+        if ticks == PRICE_NAN or math.isnan(size):
+            return
+        if operation != self.UPDATE or position >= count:
+            # Insert (or an update past the last level): shift the rows
+            # below down by one; on a full book the worst level falls off.
+            count = min(count, self.max_rows - 1)
+            position = min(position, count)
+            row_ticks[position + 1:count + 1] = row_ticks[position:count]
+            row_sizes[position + 1:count + 1] = row_sizes[position:count]
+            row_stamps[position + 1:count + 1] = row_stamps[position:count]
+            self.counts[side] = count + 1
+        row_ticks[position] = ticks
+        row_sizes[position] = size
+        row_stamps[position] = timestamp
+
+    def snapshot(self, since: float = -math.inf) -> Dict[Tuple[str, float], float]:
+        """
+        Total size per ``(side, bin price)`` of the levels last updated at
+        or after ``since``, in the format of :meth:`BookWindow.snapshot`.
+        """
+        result: Dict[Tuple[str, float], float] = {}
+        for index, side in enumerate(self.SIDES):
+            count = self.counts[index]
+            live = self.stamps[index, :count] >= since
+            bins = self.grid.bin_index(self.ticks[index, :count][live])
+            if not bins.size:
+                continue
+            keys, inverse = np.unique(bins, return_inverse=True)
+            totals = np.bincount(inverse, weights=self.sizes[index, :count][live])
+            for bin_index, total in zip(keys.tolist(), totals.tolist()):
+                result[(side, self.grid.bin_price(bin_index))] = total
+        return result
+
+    def levels(self, side: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Copies of the ``(prices, sizes)`` of ``side``, best level first."""
+        index = self.SIDES.index(side)
+        count = self.counts[index]
+        return (self.ticks[index, :count] / self.grid.scale,
+                self.sizes[index, :count].copy())
+
+    def clear(self) -> None:
+        self.ticks.fill(PRICE_NAN)
+        self.sizes.fill(0.0)
+        self.stamps.fill(-math.inf)
+        self.counts = [0, 0]
+
+
+class SymbolAggregates:
+    """
+    Aggregation state of one subscribed instrument: multi-horizon order flow
+    footprint (with aggressor side and CVD) and book windows plus a
+    time-bucketed volume profile. Created lazily by
+    :class:`OrderFlowApp` on the instrument's first tick, so prices of
+    different instruments never share a histogram. All windows share the
+    instrument's :class:`PriceGrid` (``price_scale`` ticks per unit).
+
+    Once :meth:`enable_depth` is called the book windows read the level-2
+    :class:`DepthBook` (total size per bin) instead of level-1 quotes.
+    """
+
+    def __init__(self, symbol: str, horizons: Dict[str, float], bin_size: float,
+                 profile_bucket_seconds: float = 5.0, initial_bins: int = 256,
+                 price_scale: int = 100):
+        self.symbol = symbol
+        self.horizons = horizons
+        self.grid = PriceGrid(bin_size, price_scale)
+        if not math.isclose(self.grid.bin_size, bin_size):
+            logger.warning("{}: bin size {} is not a multiple of the 1/{} price tick; "
+                           "using {}", symbol, bin_size, price_scale, self.grid.bin_size)
+        self.classifier = TradeClassifier()
+        self.orderflow = MultiHorizonFootprint(horizons, bin_size,
+                                               f"{symbol}_OrderFlow",
+                                               initial_bins=initial_bins,
+                                               price_scale=price_scale)
+        self.book = MultiHorizonBook(horizons, bin_size, f"{symbol}_Book",
+                                     price_scale=price_scale)
+        self.profile = TimeBucketedHistogram(max(horizons.values()), bin_size,
+                                             f"{symbol}_Profile",
+                                             bucket_seconds=profile_bucket_seconds,
+                                             initial_bins=initial_bins,
+                                             price_scale=price_scale)
+        self.orderflow_windows: Dict[str, HorizonView] = {
+            horizon: self.orderflow.window(horizon) for horizon in horizons
+        }
+        self.book_windows: Dict[str, HorizonView] = {
+            horizon: self.book.window(horizon) for horizon in horizons
+        }
+        self.depth: Optional[DepthBook] = None
+        # Guards the windows between the tick thread, the expiry scheduler
+        # and readers.
+        self.lock = threading.Lock()
+
+    def expire(self, now: float) -> None:
+        """Advance every window to ``now``; callers hold ``lock``."""
+        self.orderflow.expire(now)
+        self.book.expire(now)
+        self.profile.advance(now)
+
+    def rebuild(self, rows: np.ndarray, now: Optional[float] = None) -> None:
+        """
+        Rebuild every window from time-ordered ``OrderFlowBuffer.dtype`` rows
+        of this instrument (e.g. ``to_array()`` of a persisted buffer);
+        callers hold ``lock``.
+        """
+        trades = rows[(rows["tick_type"] == 5)
+                      & ~np.isnan(rows["last_price"]) & ~np.isnan(rows["last_size"])]
+        ticks = self.grid.ticks_many
+        sides = self.classifier.classify_many(ticks(trades["last_price"]),
+                                              ticks(trades["bid_price"]),
+                                              ticks(trades["ask_price"]))
+        self.orderflow.rebuild(trades["timestamp"], trades["last_price"],
+                               trades["last_size"], sides, now)
+        self.profile.rebuild(trades["timestamp"], trades["last_price"],
+                             trades["last_size"], now)
+        quotes = rows[(rows["tick_type"] == 0) | (rows["tick_type"] == 3)]
+        is_ask = quotes["tick_type"] == 3
+        self.book.rebuild(quotes["timestamp"], np.where(is_ask, "ask", "bid"),
+                          np.where(is_ask, quotes["ask_price"], quotes["bid_price"]),
+                          np.where(is_ask, quotes["ask_size"], quotes["bid_size"]),
+                          now)
+
+    def add_trade(self, timestamp: float, price: float, size: float,
+                  bid: float = math.nan, ask: float = math.nan) -> int:
+        """Record a trade against the prevailing quote; returns its side."""
+        ticks = self.grid.ticks
+        return self.add_trade_ticks(timestamp, ticks(price), size, ticks(bid), ticks(ask))
+
+    def add_trade_ticks(self, timestamp: float, ticks: int, size: float,
+                        bid_ticks: int = PRICE_NAN, ask_ticks: int = PRICE_NAN) -> int:
+        """:meth:`add_trade` with prices already converted to integer ticks."""
+        if ticks == PRICE_NAN or math.isnan(size):
+            return TradeClassifier.UNKNOWN
+        side = self.classifier.classify(ticks, bid_ticks, ask_ticks)
+        self.orderflow.add_ticks(timestamp, ticks, size, side)
+        self.profile.add_ticks(timestamp, ticks, size)
+        return side
+
+    def enable_depth(self, max_rows: int) -> None:
+        """Serve the book windows from a level-2 book of ``max_rows`` levels."""
+        self.depth = DepthBook(self.grid, max_rows)
+        self.book.depth = self.depth
+
+    def disable_depth(self) -> None:
+        """Go back to feeding the book windows from level-1 quotes."""
+        self.depth = None
+        self.book.depth = None
+
+    def add_depth(self, timestamp: float, position: int, operation: int, side: int,
+                  ticks: int, size: float) -> None:
+        """Apply one ``updateMktDepth`` row; callers hold ``lock``."""
+        if self.depth is not None:
+            self.book.add_depth(timestamp, position, operation, side, ticks, size)
+
+    def add_batch(self, timestamps: np.ndarray, tick_types: np.ndarray,
+                  columns: Dict[str, np.ndarray]) -> None:
+        """
+        Apply a time-ordered batch of snapshot rows of this instrument.
+        ``columns`` holds the forward-filled ``bid_size``/``ask_size``/
+        ``last_size`` floats and ``bid_ticks``/``ask_ticks``/``last_ticks``.
+        Trades go to the histograms in one vectorized update each; for the
+        book only the last update of every bin in the batch is applied.
+        """
+        trades = np.flatnonzero((tick_types == 5) & (columns["last_ticks"] != PRICE_NAN)
+                                & ~np.isnan(columns["last_size"]))
+        if trades.size:
+            ticks = columns["last_ticks"][trades]
+            sizes = columns["last_size"][trades]
+            sides = self.classifier.classify_many(ticks, columns["bid_ticks"][trades],
+                                                  columns["ask_ticks"][trades])
+            self.orderflow.add_many(timestamps[trades], ticks, sizes, sides)
+            self.profile.add_many(timestamps[trades], ticks, sizes)
+
+        quotes = np.flatnonzero((tick_types == 0) | (tick_types == 3))
+        if quotes.size and self.depth is None:
+            is_ask = tick_types[quotes] == 3
+            ticks = np.where(is_ask, columns["ask_ticks"][quotes],
+                             columns["bid_ticks"][quotes])
+            keys = self.grid.bin_index(ticks) * 2 + is_ask
+            _keys, first = np.unique(keys[::-1], return_index=True)
+            for i in np.sort(quotes.size - 1 - first).tolist():
+                row = quotes[i]
+                side = "ask" if is_ask[i] else "bid"
+                size = columns[f"{side}_size"][row]
+                self.book.add_ticks(float(timestamps[row]), side, int(ticks[i]), float(size))
+
+    def add_quote_ticks(self, timestamp: float, side: str, ticks: int,
+                        size: float) -> None:
+        if self.depth is None:
+            self.book.add_ticks(timestamp, side, ticks, size)
+
+
+class PeriodicTask:
+    """
+    Background thread that calls ``task(now)`` every ``interval`` seconds
+    and records the slowest run in ``max_run_seconds``.
+    """
+
+    name = "PeriodicTask"
+
+    def __init__(self, task: Callable[[float], None], interval: float):
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        self.interval = interval
+        self.max_run_seconds = 0.0
+        self._task = task
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        logger.debug("{} started (every {:.3f}s)", self.name, interval)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            start = time.perf_counter()
+            try:
+                self._task(time.time())
+            except Exception:
+                logger.exception("{} failed", self.name)
+            self.max_run_seconds = max(self.max_run_seconds,
+                                       time.perf_counter() - start)
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+class ExpiryScheduler(PeriodicTask):
+    """
+    Calls ``expire(now)`` every ``interval`` seconds.
+
+    Windows otherwise only expire inside ``add``, so a quiet market leaves
+    stale volume on display and the next tick pays for the whole backlog on
+    the IB reader thread. With the scheduler running, the tick path only
+    ever expires the last ``interval`` worth of events.
+    """
+
+    name = "ExpiryScheduler"
+
+    def __init__(self, expire: Callable[[float], None], interval: float = 0.1):
+        super().__init__(expire, interval)
+
+
+class TelemetryReporter(PeriodicTask):
+    """
+    Calls ``report(now)`` every ``interval`` seconds, so state logging never
+    runs on the IB reader thread and callback latency does not spike on
+    log intervals.
+    """
+
+    name = "TelemetryReporter"
+
+    def __init__(self, report: Callable[[float], None], interval: float = 5.0):
+        super().__init__(report, interval)
+
+
+DEFAULT_HORIZONS: Dict[str, float] = {
+    "fast": 60.0,
+    "mid": 5 * 60.0,
+    "slow": 30 * 60.0,
+}
 
-    def snapshot(self) -> Dict[Tuple[str, float], float]:
-        return {key: size for key, (ts, size) in self.latest.items()}
 
 # -----------------------------------------------------------------------------
 # IB API application
@@ -223,31 +2594,424 @@ SIZE_TICK_TYPES = {
 }
 
 
+# Tick-by-tick streams use their own request ids: the symbol's req_id plus
+# one of these offsets.
+TICK_BY_TICK_OFFSETS = {
+    "AllLast": 10_000,
+    "BidAsk": 20_000,
+}
+
+# IB errors for a tick-by-tick request that cannot be served: 10190 when the
+# account's subscription limit is reached, 10189 when the request fails.
+TICK_BY_TICK_ERRORS = {10189, 10190}
+
+# Market depth subscriptions use the symbol's req_id plus this offset. IB
+# refuses them with 309 when the depth subscription limit is reached and
+# 10092 when the exchange has no deep book.
+MARKET_DEPTH_OFFSET = 30_000
+MARKET_DEPTH_ERRORS = {309, 10092}
+
+
+class TickRing:
+    """
+    Preallocated single-producer/single-consumer ring of raw
+    ``(timestamp, req_id, tick_type, value, exchange_time)`` events;
+    ``exchange_time`` is NaN except for tick-by-tick messages.
+
+    The IB reader thread writes one row and then publishes ``_write``; the
+    ingest worker copies rows up to ``_write`` and then publishes
+    ``_read``. Each index has a single writer, so no lock is needed. When
+    the ring is full new events are dropped and counted in ``dropped``
+    rather than blocking the socket reader.
+    """
+
+    dtype = np.dtype([
+        ("timestamp", "float64"),
+        ("req_id", "int32"),
+        ("tick_type", "int32"),
+        ("value", "float64"),
+        ("exchange_time", "float64"),
+    ])
+
+    def __init__(self, capacity: int = 65_536):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.dropped = 0
+        self._rows = np.zeros(capacity, dtype=self.dtype)
+        self._write = 0
+        self._read = 0
+
+    @property
+    def depth(self) -> int:
+        """Events pushed but not yet popped."""
+        return self._write - self._read
+
+    def push(self, timestamp: float, req_id: int, tick_type: int, value: float,
+             exchange_time: float = math.nan) -> bool:
+        write = self._write
+        if write - self._read >= self.capacity:
+            self.dropped += 1
+            return False
+        self._rows[write % self.capacity] = (timestamp, req_id, tick_type, value,
+                                             exchange_time)
+        self._write = write + 1
+        return True
+
+    def pop(self, max_rows: int) -> np.ndarray:
+        """Copy out and release up to ``max_rows`` of the oldest events."""
+        read = self._read
+        count = min(self._write - read, max_rows)
+        if count <= 0:
+            return self._rows[:0].copy()
+        out = np.empty(count, dtype=self.dtype)
+        for ring_slice, src in ring_slices(read % self.capacity, count, self.capacity):
+            out[src] = self._rows[ring_slice]
+        self._read = read + count
+        return out
+
+
+class IngestWorker:
+    """
+    Background thread that drains a :class:`TickRing` in batches of up to
+    ``max_batch`` events and hands each batch to ``apply``. It sleeps for
+    ``idle_wait`` seconds whenever the ring is empty.
+
+    Metrics: ``max_depth`` (deepest queue seen at the start of a drain),
+    ``last_latency``/``max_latency`` (seconds from the oldest event of a
+    batch being pushed to the batch being applied), ``batches`` and
+    ``rows``.
+    """
+
+    def __init__(self, ring: TickRing, apply: Callable[[np.ndarray], None],
+                 max_batch: int = 4096, idle_wait: float = 0.001):
+        self.ring = ring
+        self.max_batch = max_batch
+        self.idle_wait = idle_wait
+        self.batches = 0
+        self.rows = 0
+        self.max_depth = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self._apply = apply
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="IngestWorker",
+                                        daemon=True)
+        self._thread.start()
+        logger.debug("IngestWorker draining up to {} events per batch", max_batch)
+
+    def drain_once(self) -> int:
+        """Apply one batch; returns the number of events applied."""
+        self.max_depth = max(self.max_depth, self.ring.depth)
+        batch = self.ring.pop(self.max_batch)
+        if batch.shape[0] == 0:
+            return 0
+        try:
+            self._apply(batch)
+        except Exception:
+            logger.exception("Failed to apply a batch of {} ticks", batch.shape[0])
+        latency = time.time() - float(batch["timestamp"][0])
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.batches += 1
+        self.rows += batch.shape[0]
+        return batch.shape[0]
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if not self.drain_once():
+                self._stop.wait(self.idle_wait)
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "queue_depth": self.ring.depth,
+            "max_queue_depth": self.max_depth,
+            "dropped": self.ring.dropped,
+            "batches": self.batches,
+            "rows": self.rows,
+            "mean_batch": self.rows / self.batches if self.batches else 0.0,
+            "last_drain_latency": self.last_latency,
+            "max_drain_latency": self.max_latency,
+        }
+
+    def close(self) -> None:
+        """Stop the thread and apply whatever is still queued."""
+        self._stop.set()
+        self._thread.join()
+        while self.drain_once():
+            pass
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of non-negative durations in integer nanoseconds.
+
+    Values below ``2 ** sub_bits`` ns are counted exactly; above that each
+    power of two is split into ``2 ** (sub_bits - 1)`` buckets, so a bucket
+    is never wider than ``2 ** (1 - sub_bits)`` of the values it holds (about
+    3% with the default 6 bits). ``record`` is a few integer operations and
+    one list increment; percentiles are only computed in ``summary``.
+    """
+
+    PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+    def __init__(self, sub_bits: int = 6, max_bits: int = 40):
+        if not 1 < sub_bits < max_bits:
+            raise ValueError("need 1 < sub_bits < max_bits")
+        self.sub_bits = sub_bits
+        self._half = 1 << (sub_bits - 1)
+        self._size = (max_bits - sub_bits) * self._half + (1 << sub_bits)
+        self.counts: List[int] = [0] * self._size
+        self.total = 0
+
+        index = np.arange(self._size, dtype="int64")
+        shift = np.maximum(index // self._half - 1, 0)
+        lower = (index - shift * self._half) << shift
+        self._upper = lower + (1 << shift) - 1
+
+    def record(self, nanos: int) -> None:
+        shift = nanos.bit_length() - self.sub_bits
+        if shift <= 0:
+            index = nanos
+        else:
+            index = shift * self._half + (nanos >> shift)
+            if index >= self._size:
+                index = self._size - 1
+        self.counts[index] += 1
+        self.total += nanos
+
+    def record_many(self, nanos: np.ndarray) -> None:
+        """Vectorized ``record``; negative values are counted as zero."""
+        nanos = np.maximum(np.asarray(nanos, dtype="int64").ravel(), 0)
+        if nanos.size == 0:
+            return
+        _mantissa, bits = np.frexp(nanos.astype("float64"))
+        shift = np.maximum(bits - self.sub_bits, 0)
+        index = np.minimum(shift * self._half + (nanos >> shift), self._size - 1)
+        binned = np.bincount(index, minlength=self._size)
+        counts = self.counts
+        for i in np.flatnonzero(binned).tolist():
+            counts[i] += int(binned[i])
+        self.total += int(nanos.sum())
+
+    def copy(self) -> "LatencyHistogram":
+        clone = object.__new__(LatencyHistogram)
+        clone.__dict__.update(self.__dict__)
+        clone.counts = list(self.counts)
+        return clone
+
+    def summary(self) -> Dict[str, float]:
+        """Count, mean and percentiles in microseconds (bucket upper bounds)."""
+        counts = np.array(self.counts, dtype="int64")
+        count = int(counts.sum())
+        if count == 0:
+            return {"count": 0}
+        cumulative = np.cumsum(counts)
+        out = {"count": count, "mean_us": self.total / count / 1e3}
+        for pct in self.PERCENTILES:
+            index = int(np.searchsorted(cumulative, math.ceil(count * pct / 100.0)))
+            out[f"p{pct:g}_us".replace(".", "_")] = int(self._upper[index]) / 1e3
+        out["max_us"] = int(self._upper[np.flatnonzero(counts)[-1]]) / 1e3
+        return out
+
+
+class TickStats:
+    """
+    Latency and throughput instrumentation of the tick path.
+
+    Inline callbacks record one sample per tick in each stage histogram:
+    ``snapshot`` (snapshot and tick conversion), ``append`` (buffer write)
+    and ``aggregate`` (window updates). With the ingest queue the callback
+    only records ``push``, the stage histograms hold per-batch durations of
+    ``_apply_batch``, and ``queue_lag`` holds the time each event waited in
+    the queue. ``ticks`` counts callbacks per request id.
+
+    Callbacks only append their request id and raw ``perf_counter_ns``
+    stamps to a list and hand every ``flush_every`` callbacks over as one
+    chunk. Chunks are binned by ``flush`` on the reading side, so the tick
+    thread never pays for the histogram update. At most ``max_pending``
+    chunks wait for a flush; beyond that samples are dropped and counted in
+    ``dropped_samples``.
+    """
+
+    STAGES = ("push", "snapshot", "append", "aggregate", "queue_lag")
+    TICK_STAGES = ("snapshot", "append", "aggregate")
+    PUSH_STAGES = ("push",)
+
+    def __init__(self, flush_every: int = 1024, max_pending: int = 64):
+        self.push = LatencyHistogram()
+        self.snapshot = LatencyHistogram()
+        self.append = LatencyHistogram()
+        self.aggregate = LatencyHistogram()
+        self.queue_lag = LatencyHistogram()
+        self.ticks: Dict[int, int] = defaultdict(int)
+        self.dropped_samples = 0
+        self.started = time.time()
+        self._last_read = (self.started, {})
+        self._flush_every = flush_every
+        self._max_pending = max_pending
+        self._tick_stamps: List[int] = []
+        self._push_stamps: List[int] = []
+        self._pending: deque = deque()
+        self._lock = threading.Lock()
+
+    def record_tick(self, req_id: int, started: int, updated: int,
+                    appended: int, aggregated: int) -> None:
+        stamps = self._tick_stamps
+        stamps += (req_id, started, updated, appended, aggregated)
+        if len(stamps) >= 5 * self._flush_every:
+            self._tick_stamps = []
+            self._hand_off(self.TICK_STAGES, stamps)
+
+    def record_push(self, req_id: int, started: int, pushed: int) -> None:
+        stamps = self._push_stamps
+        stamps += (req_id, started, pushed)
+        if len(stamps) >= 3 * self._flush_every:
+            self._push_stamps = []
+            self._hand_off(self.PUSH_STAGES, stamps)
+
+    def _hand_off(self, stages: Tuple[str, ...], stamps: List[int]) -> None:
+        if len(self._pending) >= self._max_pending:
+            self.dropped_samples += len(stamps) // (len(stages) + 2)
+        else:
+            self._pending.append((stages, stamps))
+
+    def flush(self) -> None:
+        """Bin the chunks handed off by the callbacks."""
+        with self._lock:
+            while self._pending:
+                stages, stamps = self._pending.popleft()
+                self._bin(stamps, self.ticks,
+                          [getattr(self, name) for name in stages])
+
+    @staticmethod
+    def _bin(stamps: List[int], ticks: Dict[int, int],
+             stages: List[LatencyHistogram]) -> None:
+        """Count rows of ``(req_id, stamp, ...)`` and bin consecutive stamp gaps."""
+        if not stamps:
+            return
+        rows = np.array(stamps, dtype="int64").reshape(-1, len(stages) + 2)
+        req_ids, counts = np.unique(rows[:, 0], return_counts=True)
+        for req_id, count in zip(req_ids.tolist(), counts.tolist()):
+            ticks[req_id] += count
+        durations = np.diff(rows[:, 1:], axis=1)
+        for column, hist in enumerate(stages):
+            hist.record_many(durations[:, column])
+
+    def stats(self, now: Optional[float] = None) -> Dict[str, object]:
+        """
+        Latency summaries per stage (including callbacks not yet handed
+        off) plus tick counts and rates per request id. Rates cover the
+        time since the previous call (or since start).
+        """
+        now = time.time() if now is None else now
+        self.flush()
+        with self._lock:
+            stages = {name: getattr(self, name).copy() for name in self.STAGES}
+            counts = defaultdict(int, self.ticks)
+            # Partial chunks are binned into the copies only.
+            for names, stamps in ((self.TICK_STAGES, list(self._tick_stamps)),
+                                  (self.PUSH_STAGES, list(self._push_stamps))):
+                self._bin(stamps, counts, [stages[name] for name in names])
+            last_time, last_counts = self._last_read
+            self._last_read = (now, dict(counts))
+        elapsed = now - last_time
+        return {
+            "latency": {name: hist.summary() for name, hist in stages.items()},
+            "ticks": dict(counts),
+            "ticks_per_second": {
+                req_id: (count - last_counts.get(req_id, 0)) / elapsed
+                if elapsed > 0 else 0.0
+                for req_id, count in counts.items()
+            },
+            "dropped_samples": self.dropped_samples,
+        }
+
+
 class OrderFlowApp(EWrapper, EClient):
+    # quiet: point of control and CVD per symbol; normal: adds top bins and
+    # best book levels; verbose: adds the buffer tail and full book windows.
+    LOG_VERBOSITY = {"quiet": 0, "normal": 1, "verbose": 2}
+
     def __init__(self, host: str, port: int, client_id: int,
                  buffer_capacity: int, bin_size: float,
-                 log_tail_size: int = 5):
+                 log_tail_size: int = 5, buffer_path: Optional[str] = None,
+                 buffer_profile: str = "default",
+                 price_scales: Optional[Dict[int, int]] = None,
+                 partition_buffer: bool = False, event_log: bool = False,
+                 spill_dir: Optional[str] = None,
+                 horizons: Optional[Dict[str, float]] = None,
+                 profile_bucket_seconds: float = 5.0,
+                 expiry_interval: float = 0.1,
+                 ingest_queue: int = 0,
+                 log_interval: float = 5.0, log_verbosity: str = "normal",
+                 instrument: bool = False, stats_interval: float = 0.0,
+                 tick_by_tick: bool = False, market_depth: int = 0):
         EClient.__init__(self, wrapper=self)
         self.host = host
         self.port = port
         self.client_id = client_id
         self._connected = threading.Event()
-        self.buffer = OrderFlowBuffer(buffer_capacity)
+        self.spill_writer: Optional[SegmentWriter] = None
+        if event_log:
+            if partition_buffer or buffer_path or spill_dir:
+                raise ValueError("event_log cannot be combined with a "
+                                 "partitioned, file-backed or spilling buffer")
+            self.buffer = OrderFlowEventLog(buffer_capacity)
+        else:
+            if spill_dir:
+                self.spill_writer = SegmentWriter(
+                    spill_dir, OrderFlowBuffer.profiles[buffer_profile])
+            if partition_buffer:
+                self.buffer = PartitionedOrderFlowBuffer(
+                    buffer_capacity, directory=buffer_path,
+                    profile=buffer_profile, price_scales=price_scales,
+                    eviction_sink=self.spill_writer)
+            else:
+                self.buffer = OrderFlowBuffer(buffer_capacity, path=buffer_path,
+                                              profile=buffer_profile,
+                                              price_scales=price_scales,
+                                              eviction_sink=self.spill_writer)
         self.snapshots: Dict[int, Snapshot] = defaultdict(Snapshot)
+        if log_verbosity not in self.LOG_VERBOSITY:
+            raise ValueError(f"log_verbosity must be one of {sorted(self.LOG_VERBOSITY)}")
         self._log_tail_size = log_tail_size
-        self._last_log = 0.0
-        self._log_interval = 5.0
+        self.log_interval = log_interval
+        # Buffer tail for the verbose report, copied by the writing thread
+        # every log interval: buffers are single-writer, so the telemetry
+        # thread never reads them directly.
+        self._published_tail: Optional[np.ndarray] = None
+        self._tail_due = 0.0 if log_interval > 0 else math.inf
+        self.log_verbosity = self.LOG_VERBOSITY[log_verbosity]
+        self.telemetry: Optional[TelemetryReporter] = None
         self.bin_size = bin_size
-        self.orderflow_windows: Dict[str, SlidingHistogram] = {
-            "fast": SlidingHistogram(60.0, bin_size, "OrderFlow_fast"),
-            "mid": SlidingHistogram(5 * 60.0, bin_size, "OrderFlow_mid"),
-            "slow": SlidingHistogram(30 * 60.0, bin_size, "OrderFlow_slow"),
-        }
-        self.book_windows: Dict[str, BookWindow] = {
-            "fast": BookWindow(60.0, bin_size, "Book_fast"),
-            "mid": BookWindow(5 * 60.0, bin_size, "Book_mid"),
-            "slow": BookWindow(30 * 60.0, bin_size, "Book_slow"),
-        }
+        self.price_scales: Dict[int, int] = dict(price_scales or {})
+        self.horizons = dict(horizons or DEFAULT_HORIZONS)
+        self.profile_bucket_seconds = profile_bucket_seconds
+        self.symbols: Dict[int, str] = {}
+        self.req_ids: Dict[str, int] = {}
+        self.aggregates: Dict[int, SymbolAggregates] = {}
+        # Guards creation of aggregates, which happens on the main thread
+        # (contract registration, depth requests) as well as the ingest path.
+        self._aggregates_lock = threading.Lock()
+        self.expiry_interval = expiry_interval
+        self.expiry_scheduler: Optional[ExpiryScheduler] = None
+        # With a queue, callbacks only push raw events and IngestWorker
+        # applies them in batches; without one they are applied inline.
+        self.ingest = TickRing(ingest_queue) if ingest_queue > 0 else None
+        self.ingest_worker: Optional[IngestWorker] = None
+        self.tick_stats = TickStats() if instrument else None
+        self.stats_interval = stats_interval
+        self.stats_reporter: Optional[TelemetryReporter] = None
+        # Tick-by-tick mode: stream request id -> symbol req_id, and the last
+        # (bid, ask, bid_size, ask_size, last) seen per symbol so only
+        # changed fields become ticks.
+        self.tick_by_tick = tick_by_tick
+        self.contracts: Dict[int, Contract] = {}
+        self.tick_by_tick_streams: Dict[int, int] = {}
+        self._tick_by_tick_quotes: Dict[int, List[float]] = {}
+        # Level-2 rows per symbol (0 disables reqMktDepth).
+        self.market_depth = market_depth
 
     # ------------------------------------------------------------------
     # Connection management
@@ -263,6 +3027,18 @@ class OrderFlowApp(EWrapper, EClient):
         # Wait for nextValidId to be received as proof of connection
         if not self._connected.wait(timeout=10.0):
             raise RuntimeError("Failed to receive nextValidId within timeout")
+        if self.ingest is not None and self.ingest_worker is None:
+            self.ingest_worker = IngestWorker(self.ingest, self._apply_batch)
+        if self.expiry_interval > 0 and self.expiry_scheduler is None:
+            self.expiry_scheduler = ExpiryScheduler(self.expire_windows,
+                                                    self.expiry_interval)
+        if self.log_interval > 0 and self.telemetry is None:
+            self.telemetry = TelemetryReporter(self._log_state, self.log_interval)
+        if self.tick_stats is not None and self.stats_reporter is None:
+            # Bins the callbacks' latency samples off the tick thread, and
+            # dumps them when a stats interval is configured.
+            self.stats_reporter = TelemetryReporter(self._report_stats,
+                                                    self.stats_interval or 1.0)
 
     def nextValidId(self, orderId: int):
         logger.info("Connection confirmed. Next valid order id: {}", orderId)
@@ -270,6 +3046,15 @@ class OrderFlowApp(EWrapper, EClient):
 
     def error(self, reqId: int, errorCode: int, errorString: str):
         logger.error("Error. reqId={} code={} msg={}", reqId, errorCode, errorString)
+        if errorCode in TICK_BY_TICK_ERRORS and reqId in self.tick_by_tick_streams:
+            self._fall_back_to_market_data(self.tick_by_tick_streams[reqId])
+        elif errorCode in MARKET_DEPTH_ERRORS and reqId - MARKET_DEPTH_OFFSET in self.aggregates:
+            aggregates = self.aggregates[reqId - MARKET_DEPTH_OFFSET]
+            if aggregates.depth is not None:
+                logger.warning("Market depth unavailable for {}; book windows use "
+                               "level-1 quotes", aggregates.symbol)
+                with aggregates.lock:
+                    aggregates.disable_depth()
 
     # ------------------------------------------------------------------
     # Market data handlers
@@ -277,20 +3062,122 @@ class OrderFlowApp(EWrapper, EClient):
 
     def tickPrice(self, reqId: int, tickType: int, price: float,
                   attrib: TickAttrib):
-        if tickType not in PRICE_TICK_TYPES:
+        if tickType in PRICE_TICK_TYPES:
+            self._price_tick(time.time(), reqId, tickType, price)
+
+    def tickSize(self, reqId: int, tickType: int, size: float):
+        if tickType in SIZE_TICK_TYPES:
+            self._size_tick(time.time(), reqId, tickType, float(size))
+
+    def tickByTickAllLast(self, reqId: int, tickType: int, exchangeTime: int,
+                          price: float, size: float, tickAttribLast: TickAttribLast,
+                          exchange: str, specialConditions: str):
+        """
+        One trade print. Like every other tick it is stamped with the local
+        receive time, so the buffer stays time-ordered across symbols; the
+        exchange time (whole seconds) goes to ``Snapshot.exchange_time``.
+        """
+        req_id = self.tick_by_tick_streams.get(reqId)
+        if req_id is None:
+            return
+        timestamp = time.time()
+        exchange_time = float(exchangeTime)
+        if self.ingest is None:
+            self.snapshots[req_id].exchange_time = exchange_time
+        quote = self._tick_by_tick_quotes[req_id]
+        if price != quote[4]:
+            quote[4] = price
+            self._price_tick(timestamp, req_id, 4, price, exchange_time)
+        self._size_tick(timestamp, req_id, 5, float(size), exchange_time)
+
+    def tickByTickBidAsk(self, reqId: int, exchangeTime: int, bidPrice: float,
+                         askPrice: float, bidSize: float, askSize: float,
+                         tickAttribBidAsk: TickAttribBidAsk):
+        """
+        Top-of-book update, stamped like :meth:`tickByTickAllLast`. Only
+        the fields that changed become ticks, as with ``reqMktData``; a
+        side's size is re-sent whenever its price moves so the book windows
+        see the new level.
+        """
+        req_id = self.tick_by_tick_streams.get(reqId)
+        if req_id is None:
+            return
+        timestamp = time.time()
+        exchange_time = float(exchangeTime)
+        if self.ingest is None:
+            self.snapshots[req_id].exchange_time = exchange_time
+        quote = self._tick_by_tick_quotes[req_id]
+        bid_size, ask_size = float(bidSize), float(askSize)
+        bid_moved = bidPrice != quote[0]
+        ask_moved = askPrice != quote[1]
+        if bid_moved:
+            quote[0] = bidPrice
+            self._price_tick(timestamp, req_id, 1, bidPrice, exchange_time)
+        if ask_moved:
+            quote[1] = askPrice
+            self._price_tick(timestamp, req_id, 2, askPrice, exchange_time)
+        if bid_moved or bid_size != quote[2]:
+            quote[2] = bid_size
+            self._size_tick(timestamp, req_id, 0, bid_size, exchange_time)
+        if ask_moved or ask_size != quote[3]:
+            quote[3] = ask_size
+            self._size_tick(timestamp, req_id, 3, ask_size, exchange_time)
+
+    def updateMktDepth(self, reqId: int, position: int, operation: int, side: int,
+                       price: float, size: float):
+        self._depth_update(reqId, position, operation, side, price, size)
+
+    def updateMktDepthL2(self, reqId: int, position: int, marketMaker: str,
+                         operation: int, side: int, price: float, size: float,
+                         isSmartDepth: bool):
+        self._depth_update(reqId, position, operation, side, price, size)
+
+    # ------------------------------------------------------------------
+    # Helpers
+    # ------------------------------------------------------------------
+
+    def _depth_update(self, reqId: int, position: int, operation: int, side: int,
+                      price: float, size: float) -> None:
+        aggregates = self.aggregates.get(reqId - MARKET_DEPTH_OFFSET)
+        if aggregates is None or aggregates.depth is None:
+            return
+        ticks = aggregates.grid.ticks(price)
+        with aggregates.lock:
+            aggregates.add_depth(time.time(), position, operation, side, ticks,
+                                 float(size))
+
+    def _price_tick(self, timestamp: float, reqId: int, tickType: int,
+                    price: float, exchange_time: float = math.nan) -> None:
+        stats = self.tick_stats
+        started = time.perf_counter_ns() if stats is not None else 0
+        if self.ingest is not None:
+            self.ingest.push(timestamp, reqId, tickType, price, exchange_time)
+            if stats is not None:
+                stats.record_push(reqId, started, time.perf_counter_ns())
             return
         snapshot = self.snapshots[reqId]
+        # Converted to integer ticks once here; the windows only see ticks.
+        ticks = self._aggregates_for(reqId).grid.ticks(price)
         if tickType == 1:  # BID
             snapshot.bid_price = price
+            snapshot.bid_ticks = ticks
         elif tickType == 2:  # ASK
             snapshot.ask_price = price
+            snapshot.ask_ticks = ticks
         elif tickType == 4:  # LAST
             snapshot.last_price = price
-
-        self._record_tick(reqId, tickType, snapshot)
-
-    def tickSize(self, reqId: int, tickType: int, size: float):
-        if tickType not in SIZE_TICK_TYPES:
+            snapshot.last_ticks = ticks
+
+        self._record_tick(timestamp, reqId, tickType, snapshot, started)
+
+    def _size_tick(self, timestamp: float, reqId: int, tickType: int,
+                   size: float, exchange_time: float = math.nan) -> None:
+        stats = self.tick_stats
+        started = time.perf_counter_ns() if stats is not None else 0
+        if self.ingest is not None:
+            self.ingest.push(timestamp, reqId, tickType, size, exchange_time)
+            if stats is not None:
+                stats.record_push(reqId, started, time.perf_counter_ns())
             return
         snapshot = self.snapshots[reqId]
         if tickType == 0:  # BID_SIZE
@@ -302,55 +3189,378 @@ class OrderFlowApp(EWrapper, EClient):
         elif tickType == 8:  # VOLUME
             snapshot.volume = size
 
-        self._record_tick(reqId, tickType, snapshot)
+        self._record_tick(timestamp, reqId, tickType, snapshot, started)
 
-    # ------------------------------------------------------------------
-    # Helpers
-    # ------------------------------------------------------------------
-
-    def _record_tick(self, req_id: int, tick_type: int, snapshot: Snapshot):
-        now = time.time()
-        self.buffer.append(req_id, tick_type, snapshot)
-        self._handle_aggregations(now, tick_type, snapshot)
-        if now - self._last_log >= self._log_interval:
-            self._log_state(now)
+    def _record_tick(self, now: float, req_id: int, tick_type: int,
+                     snapshot: Snapshot, started: int = 0):
+        stats = self.tick_stats
+        if stats is None:
+            self.buffer.append(req_id, tick_type, snapshot, now)
+            self._handle_aggregations(now, req_id, tick_type, snapshot)
+        else:
+            updated = time.perf_counter_ns()
+            self.buffer.append(req_id, tick_type, snapshot, now)
+            appended = time.perf_counter_ns()
+            self._handle_aggregations(now, req_id, tick_type, snapshot)
+            stats.record_tick(req_id, started, updated, appended, time.perf_counter_ns())
+        if now >= self._tail_due:
+            self._publish_tail(now)
+
+    def _publish_tail(self, now: float) -> None:
+        self._published_tail = self.buffer.tail(self._log_tail_size)
+        self._tail_due = now + self.log_interval
+
+    def _apply_batch(self, batch: np.ndarray) -> None:
+        """
+        Apply a batch of raw events from the ingest ring: rebuild the
+        snapshot rows with a vectorized per-ticker forward fill, append them
+        to the buffer in one call and update each ticker's windows once.
+        """
+        stats = self.tick_stats
+        count = batch.shape[0]
+        timestamps = batch["timestamp"]
+        req_ids = batch["req_id"]
+        tick_types = batch["tick_type"]
+        if stats is not None:
+            stats.queue_lag.record_many((time.time() - timestamps) * 1e9)
+            started = time.perf_counter_ns()
+
+        # Group by ticker, keeping arrival order within each group.
+        order = np.argsort(req_ids, kind="stable")
+        sorted_ids = req_ids[order]
+        sorted_types = tick_types[order]
+        sorted_values = batch["value"][order]
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        stops = np.r_[starts[1:], count]
+        group_of_row = np.repeat(np.arange(starts.size), stops - starts)
+        row_start = starts[group_of_row]
+        group_ids = sorted_ids[starts].tolist()
+        snapshots = [self.snapshots[req_id] for req_id in group_ids]
+        positions = np.arange(count)
+
+        columns: Dict[str, np.ndarray] = {}
+        for tick_type, name in OrderFlowEventLog.field_by_tick_type.items():
+            last_set = np.maximum.accumulate(
+                np.where(sorted_types == tick_type, positions, -1))
+            initial = np.array([getattr(snapshot, name) for snapshot in snapshots],
+                               dtype="float64")
+            columns[name] = np.where(last_set >= row_start,
+                                     sorted_values[np.maximum(last_set, 0)],
+                                     initial[group_of_row])
+        grids = [self._aggregates_for(req_id).grid for req_id in group_ids]
+        scales = np.array([grid.scale for grid in grids], dtype="float64")[group_of_row]
+        for name in OrderFlowBuffer.price_fields:
+            prices = columns[name]
+            nan_mask = np.isnan(prices)
+            ticks = np.rint(np.where(nan_mask, 0.0, prices * scales)).astype("int64")
+            ticks[nan_mask] = PRICE_NAN
+            columns[name.replace("_price", "_ticks")] = ticks
+
+        if stats is not None:
+            updated = time.perf_counter_ns()
+        if isinstance(self.buffer, OrderFlowEventLog):
+            self.buffer.append_many(timestamps, req_ids, tick_types, batch["value"])
+        else:
+            arrival = np.empty(count, dtype="int64")
+            arrival[order] = positions
+            self.buffer.append_many(
+                timestamps, req_ids, tick_types,
+                **{name: columns[name][arrival] for name in OrderFlowEventLog.fields})
+        if stats is not None:
+            appended = time.perf_counter_ns()
+
+        sorted_timestamps = timestamps[order]
+        sorted_exchange = batch["exchange_time"][order]
+        for group, req_id in enumerate(group_ids):
+            start, stop = int(starts[group]), int(stops[group])
+            aggregates = self._aggregates_for(req_id)
+            with aggregates.lock:
+                aggregates.add_batch(sorted_timestamps[start:stop],
+                                     sorted_types[start:stop],
+                                     {name: column[start:stop]
+                                      for name, column in columns.items()})
+            snapshot = snapshots[group]
+            for name, column in columns.items():
+                value = column[stop - 1].item()
+                setattr(snapshot, name, value)
+            exchange = sorted_exchange[start:stop]
+            exchange = exchange[~np.isnan(exchange)]
+            if exchange.size:
+                snapshot.exchange_time = float(exchange[-1])
+        if stats is not None:
+            stats.snapshot.record(updated - started)
+            stats.append.record(appended - updated)
+            stats.aggregate.record(time.perf_counter_ns() - appended)
+        now = float(timestamps[-1])
+        if now >= self._tail_due:
+            self._publish_tail(now)
+
+    def ingest_metrics(self) -> Dict[str, float]:
+        """Queue depth, drops and drain latency of the batched ingest path."""
+        if self.ingest_worker is None:
+            return {}
+        return self.ingest_worker.metrics()
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Tick-path instrumentation (see :class:`TickStats`) plus the ingest
+        queue metrics when the app was created with ``instrument=True``, and
+        the spill writer's counters (``"spill"``) when rows are spilled.
+        """
+        stats: Dict[str, object] = {}
+        if self.tick_stats is not None:
+            stats = self.tick_stats.stats()
+            stats["ingest"] = self.ingest_metrics()
+        if self.spill_writer is not None:
+            stats["spill"] = self.spill_writer.stats()
+        return stats
+
+    def register_contracts(self, contracts: Iterable[Contract]
+                           ) -> List[Tuple[int, Contract]]:
+        """
+        Assign request ids (1, 2, ...) to ``contracts`` in order and create
+        their aggregation windows before any callback can arrive.
+        """
+        assigned = list(enumerate(contracts, start=1))
+        for req_id, contract in assigned:
+            self.symbols[req_id] = contract.symbol
+            self.req_ids[contract.symbol] = req_id
+            self.contracts[req_id] = contract
+            self._aggregates_for(req_id)
+        return assigned
 
     def request_market_data(self, contracts: Iterable[Contract]) -> None:
-        for req_id, contract in enumerate(contracts, start=1):
-            logger.info("Requesting market data for {} (req_id={})",
+        """
+        Subscribe every contract: to the AllLast and BidAsk tick-by-tick
+        streams in tick-by-tick mode, otherwise to ``reqMktData``. A symbol
+        whose tick-by-tick request is refused falls back to ``reqMktData``
+        (see :meth:`error`).
+        """
+        for req_id, contract in self.register_contracts(contracts):
+            if not self.tick_by_tick:
+                logger.info("Requesting market data for {} (req_id={})",
+                            contract.symbol, req_id)
+                self.reqMktData(req_id, contract, "", False, False, [])
+                continue
+            logger.info("Requesting tick-by-tick data for {} (req_id={})",
                         contract.symbol, req_id)
-            self.reqMktData(req_id, contract, "", False, False, [])
-
-    def _handle_aggregations(self, timestamp: float, tick_type: int,
+            self._tick_by_tick_quotes[req_id] = [math.nan] * 5
+            for offset in TICK_BY_TICK_OFFSETS.values():
+                self.tick_by_tick_streams[req_id + offset] = req_id
+            for tick_type, offset in TICK_BY_TICK_OFFSETS.items():
+                self.reqTickByTickData(req_id + offset, contract, tick_type, 0, False)
+
+    def request_market_depth(self, contracts: Iterable[Contract]) -> None:
+        """
+        Subscribe every registered contract to ``market_depth`` rows of
+        level-2 data (SMART depth for SMART-routed contracts) and switch its
+        book windows over to the depth book.
+        """
+        for contract in contracts:
+            req_id = self.req_ids[contract.symbol]
+            aggregates = self._aggregates_for(req_id)
+            with aggregates.lock:
+                aggregates.enable_depth(self.market_depth)
+            logger.info("Requesting {} rows of market depth for {} (req_id={})",
+                        self.market_depth, contract.symbol, req_id + MARKET_DEPTH_OFFSET)
+            self.reqMktDepth(req_id + MARKET_DEPTH_OFFSET, contract, self.market_depth,
+                             contract.exchange == "SMART", [])
+
+    def _fall_back_to_market_data(self, req_id: int) -> None:
+        """Cancel both tick-by-tick streams of ``req_id`` and use ``reqMktData``."""
+        for offset in TICK_BY_TICK_OFFSETS.values():
+            if self.tick_by_tick_streams.pop(req_id + offset, None) is not None:
+                self.cancelTickByTickData(req_id + offset)
+        contract = self.contracts[req_id]
+        logger.warning("Tick-by-tick data unavailable for {}; falling back to "
+                       "reqMktData (req_id={})", contract.symbol, req_id)
+        self.reqMktData(req_id, contract, "", False, False, [])
+
+    def warm_start(self, rows: Optional[np.ndarray] = None,
+                   now: Optional[float] = None) -> None:
+        """
+        Rebuild the windows of every ticker present in ``rows`` (default:
+        the current buffer contents), so a restarted app serves meaningful
+        profiles immediately instead of after the slowest horizon.
+        """
+        if rows is None:
+            rows = self.buffer.to_array()
+        now = time.time() if now is None else now
+        slowest = max(self.horizons.values())
+        rows = rows[rows["timestamp"] >= now - slowest]
+        if rows.shape[0] == 0:
+            logger.warning("Warm start found no rows from the last {:.0f}s; "
+                           "windows start empty", slowest)
+            return
+        rows = rows[np.argsort(rows["timestamp"], kind="stable")]
+        for req_id in np.unique(rows["ticker_id"]).tolist():
+            aggregates = self._aggregates_for(req_id)
+            with aggregates.lock:
+                aggregates.rebuild(rows[rows["ticker_id"] == req_id], now)
+        logger.info("Warm-started windows from {} rows", rows.shape[0])
+
+    def _aggregates_for(self, req_id: int) -> SymbolAggregates:
+        aggregates = self.aggregates.get(req_id)
+        if aggregates is not None:
+            return aggregates
+        with self._aggregates_lock:
+            aggregates = self.aggregates.get(req_id)
+            if aggregates is not None:
+                return aggregates
+            symbol = self.symbols.get(req_id, str(req_id))
+            scale = self.price_scales.get(req_id, OrderFlowBuffer.DEFAULT_PRICE_SCALE)
+            aggregates = SymbolAggregates(symbol, self.horizons, self.bin_size,
+                                          self.profile_bucket_seconds,
+                                          price_scale=scale)
+            self.aggregates[req_id] = aggregates
+            logger.debug("Created aggregation windows for {} (req_id={})",
+                         symbol, req_id)
+        return aggregates
+
+    def _handle_aggregations(self, timestamp: float, req_id: int, tick_type: int,
                               snapshot: Snapshot) -> None:
         if tick_type == 5:  # LAST_SIZE
-            price = float(snapshot.last_price)
             size = float(snapshot.last_size)
-            for hist in self.orderflow_windows.values():
-                hist.add(timestamp, price, size)
+            aggregates = self._aggregates_for(req_id)
+            with aggregates.lock:
+                aggregates.add_trade_ticks(timestamp, snapshot.last_ticks, size,
+                                           snapshot.bid_ticks, snapshot.ask_ticks)
         elif tick_type in (0, 3):  # BID_SIZE or ASK_SIZE
             side = "bid" if tick_type == 0 else "ask"
-            price = snapshot.bid_price if side == "bid" else snapshot.ask_price
+            ticks = snapshot.bid_ticks if side == "bid" else snapshot.ask_ticks
             size = snapshot.bid_size if side == "bid" else snapshot.ask_size
-            price = float(price)
             size = float(size)
-            for book in self.book_windows.values():
-                book.add(timestamp, side, price, size)
-
-    def _log_state(self, timestamp: float) -> None:
-        tail = self.buffer.tail(self._log_tail_size)
-        if tail.size > 0:
-            logger.info("Latest {} ticks:\n{}", self._log_tail_size, tail)
+            aggregates = self._aggregates_for(req_id)
+            with aggregates.lock:
+                aggregates.add_quote_ticks(timestamp, side, ticks, size)
+
+    def get_profile(self, symbol: str, horizon) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Trade volume per price bin for ``symbol``. ``horizon`` is either a
+        configured horizon name (e.g. ``"fast"``) or a window in seconds up to
+        the slowest horizon, answered from the time-bucketed profile.
+        """
+        aggregates = self._symbol_aggregates(symbol)
+        if aggregates is None:
+            return np.empty(0), np.empty(0)
+        now = time.time()
+        with aggregates.lock:
+            aggregates.expire(now)
+            if isinstance(horizon, str):
+                return aggregates.orderflow.snapshot(horizon)
+            return aggregates.profile.volume_profile(float(horizon), now)
+
+    def get_footprint(self, symbol: str, horizon: str
+                      ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+        """Return ``(prices, buy_volumes, sell_volumes, cvd)`` of ``symbol`` over ``horizon``."""
+        aggregates = self._symbol_aggregates(symbol)
+        if aggregates is None:
+            return np.empty(0), np.empty(0), np.empty(0), 0.0
+        with aggregates.lock:
+            aggregates.expire(time.time())
+            prices, buy, sell = aggregates.orderflow.footprint(horizon)
+            return prices, buy, sell, aggregates.orderflow.cvd(horizon)
+
+    def get_depth(self, symbol: str
+                  ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return ``(bid_prices, bid_sizes, ask_prices, ask_sizes)`` of the
+        level-2 book of ``symbol``, best level first (empty without depth).
+        """
+        empty = np.empty(0), np.empty(0), np.empty(0), np.empty(0)
+        aggregates = self._symbol_aggregates(symbol)
+        if aggregates is None:
+            return empty
+        with aggregates.lock:
+            depth = aggregates.depth
+            if depth is None:
+                return empty
+            return depth.levels("bid") + depth.levels("ask")
+
+    def expire_windows(self, now: float) -> None:
+        """Advance the windows of every symbol to ``now``."""
+        for aggregates in list(self.aggregates.values()):
+            with aggregates.lock:
+                aggregates.expire(now)
+
+    def _symbol_aggregates(self, symbol: str) -> Optional[SymbolAggregates]:
+        req_id = self.req_ids.get(symbol)
+        return self.aggregates.get(req_id) if req_id is not None else None
+
+    def _report_stats(self, timestamp: float) -> None:
+        if self.stats_interval > 0:
+            self._log_stats(timestamp)
         else:
-            logger.info("No data recorded yet")
-
-        for hist in self.orderflow_windows.values():
-            logger.info("{} top bins: {}", hist.name, hist.top_bins())
-
-        for book in self.book_windows.values():
-            logger.info("{} snapshot: {}", book.name, book.snapshot())
+            self.tick_stats.flush()
+
+    def _log_stats(self, timestamp: float) -> None:
+        stats = self.stats()
+        for stage, summary in stats["latency"].items():
+            if summary["count"]:
+                logger.info("Latency {:<10} n={} mean={:.2f}us p50={:.2f}us "
+                            "p99={:.2f}us p99.9={:.2f}us max={:.2f}us",
+                            stage, summary["count"], summary["mean_us"],
+                            summary["p50_us"], summary["p99_us"],
+                            summary["p99_9_us"], summary["max_us"])
+        rates = ", ".join(f"{self.symbols.get(req_id, req_id)}={rate:.1f}"
+                          for req_id, rate in sorted(stats["ticks_per_second"].items()))
+        logger.info("Ticks/s: {} (dropped samples: {})", rates or "none",
+                    stats["dropped_samples"])
+        if stats["ingest"]:
+            logger.info("Ingest: {}", stats["ingest"])
+        if "spill" in stats:
+            logger.info("Spill: {}", stats["spill"])
 
-        self._last_log = timestamp
+    def _log_state(self, timestamp: float) -> None:
+        """
+        Log the aggregation state (run by :class:`TelemetryReporter`). Each
+        symbol's lock is held only while its pre-aggregated values are
+        collected: POC and top bins come from the segment trees, CVD is a
+        running sum, and full book windows are only read when verbose.
+        Formatting happens after the lock is released. The buffer itself is
+        not read here; the tail comes from the copy published by the tick
+        path.
+        """
+        verbosity = self.log_verbosity
+        if verbosity >= 2:
+            tail = self._published_tail
+            if tail is not None and tail.size > 0:
+                logger.info("Latest {} ticks:\n{}", self._log_tail_size, tail)
+            else:
+                logger.info("No data recorded yet")
+
+        for aggregates in list(self.aggregates.values()):
+            lines = []
+            with aggregates.lock:
+                orderflow = aggregates.orderflow
+                for horizon, hist in aggregates.orderflow_windows.items():
+                    if verbosity == 0:
+                        lines.append((hist.name, "POC", hist.point_of_control(),
+                                      orderflow.cvd(horizon)))
+                    else:
+                        lines.append((hist.name, "top bins", hist.top_bins(),
+                                      orderflow.cvd(horizon)))
+                if verbosity >= 1 and aggregates.depth is not None:
+                    bid_prices, bid_sizes = aggregates.depth.levels("bid")
+                    ask_prices, ask_sizes = aggregates.depth.levels("ask")
+                    lines.append((f"{aggregates.symbol}_Depth", "bids",
+                                  list(zip(bid_prices[:3].tolist(), bid_sizes[:3].tolist())),
+                                  None))
+                    lines.append((f"{aggregates.symbol}_Depth", "asks",
+                                  list(zip(ask_prices[:3].tolist(), ask_sizes[:3].tolist())),
+                                  None))
+                if verbosity >= 1:
+                    for book in aggregates.book_windows.values():
+                        levels = book.snapshot() if verbosity >= 2 else book.top_bins(3)
+                        lines.append((book.name, "levels", levels, None))
+            for name, label, value, cvd in lines:
+                if cvd is None:
+                    logger.info("{} {}: {}", name, label, value)
+                else:
+                    logger.info("{} {}: {} | CVD {:+.0f}", name, label, value, cvd)
+
+        if self.ingest_worker is not None and verbosity >= 1:
+            logger.info("Ingest: {}", self.ingest_worker.metrics())
 
 
 # -----------------------------------------------------------------------------
@@ -366,6 +3576,49 @@ def create_stock_contract(symbol: str) -> Contract:
     return contract
 
 
+def parse_horizons(entries: Iterable[str]) -> Optional[Dict[str, float]]:
+    """Parse ``NAME=SECONDS`` entries; None keeps ``DEFAULT_HORIZONS``."""
+    horizons: Dict[str, float] = {}
+    for entry in entries:
+        name, sep, seconds = entry.partition("=")
+        if not sep or not name:
+            raise ValueError(f"Invalid --horizon entry {entry!r}")
+        horizons[name] = float(seconds)
+    return horizons or None
+
+
+# Minimum price increments of symbols that do not trade in cents. SPX
+# quotes in 0.05 below 3.00 and 0.10 above, so a 0.05 grid covers both.
+DEFAULT_MIN_TICKS: Dict[str, float] = {
+    "SPX": 0.05,
+}
+
+
+def parse_price_scales(entries: Iterable[str], symbols: List[str],
+                       min_ticks: Iterable[str] = ()) -> Dict[int, int]:
+    """
+    Map ``SYMBOL=TICKS`` (ticks per unit) and ``SYMBOL=MIN_TICK`` entries
+    onto the req ids used for ``symbols``. Symbols listed in
+    ``DEFAULT_MIN_TICKS`` get their scale unless overridden.
+    """
+    req_ids = {sym.upper(): req_id for req_id, sym in enumerate(symbols, start=1)}
+    scales: Dict[int, int] = {}
+    for symbol, tick in DEFAULT_MIN_TICKS.items():
+        if symbol in req_ids:
+            scales[req_ids[symbol]] = round(1 / tick)
+    for entry in min_ticks:
+        symbol, sep, tick = entry.partition("=")
+        if not sep or symbol.upper() not in req_ids or float(tick) <= 0:
+            raise ValueError(f"Invalid --min-tick entry {entry!r}")
+        scales[req_ids[symbol.upper()]] = round(1 / float(tick))
+    for entry in entries:
+        symbol, sep, ticks = entry.partition("=")
+        if not sep or symbol.upper() not in req_ids:
+            raise ValueError(f"Invalid --price-scale entry {entry!r}")
+        scales[req_ids[symbol.upper()]] = int(ticks)
+    return scales
+
+
 # -----------------------------------------------------------------------------
 # CLI handling
 # -----------------------------------------------------------------------------
@@ -378,8 +3631,68 @@ def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
                         help="Ticker symbol to subscribe to (repeatable).")
     parser.add_argument("--buffer-capacity", type=int, default=180_000,
                         help="Maximum number of rows retained in the buffer.")
+    parser.add_argument("--buffer-path", type=str, default=None,
+                        help="Memory-map the tick buffer to this file so it "
+                             "survives restarts and can be read by other processes.")
+    parser.add_argument("--partition-buffer", action="store_true",
+                        help="Keep one ring of --buffer-capacity rows per symbol; "
+                             "--buffer-path is then a directory.")
+    parser.add_argument("--spill-dir", type=str, default=None,
+                        help="Write rows evicted from the ring to rotating segment "
+                             "files in this directory (full-day history).")
+    parser.add_argument("--event-log", action="store_true",
+                        help="Store one (timestamp, id, tick type, value) event per "
+                             "tick and rebuild snapshot rows on demand.")
+    parser.add_argument("--buffer-profile", choices=sorted(OrderFlowBuffer.profiles),
+                        default="default",
+                        help="Row layout of the buffer; 'compact' uses 43 instead "
+                             "of 72 bytes per row so a full session fits in RAM.")
+    parser.add_argument("--price-scale", action="append", default=[],
+                        metavar="SYMBOL=TICKS",
+                        help="Price ticks per unit for a symbol, used by the "
+                             "compact profile and the aggregation windows "
+                             f"(default {OrderFlowBuffer.DEFAULT_PRICE_SCALE}).")
+    parser.add_argument("--min-tick", action="append", default=[],
+                        metavar="SYMBOL=TICK",
+                        help="Minimum price increment of a symbol, e.g. SPX=0.05; "
+                             "an alternative to --price-scale.")
     parser.add_argument("--price-bin-size", type=float, default=0.01,
                         help="Price bin size used for OrderFlow histograms.")
+    parser.add_argument("--horizon", action="append", default=[],
+                        metavar="NAME=SECONDS",
+                        help="Aggregation window (repeatable); defaults to "
+                             "fast=60, mid=300, slow=1800.")
+    parser.add_argument("--warm-start", action="store_true",
+                        help="Rebuild the aggregation windows from the buffer "
+                             "contents at startup (use with --buffer-path).")
+    parser.add_argument("--ingest-queue", type=int, default=0,
+                        help="Capacity of the raw tick ring drained in batches by "
+                             "an ingest worker thread, e.g. 65536 (default 0: "
+                             "apply ticks inline on the IB reader thread).")
+    parser.add_argument("--log-interval", type=float, default=5.0,
+                        help="Seconds between state reports of the telemetry "
+                             "thread (0 disables them).")
+    parser.add_argument("--log-verbosity", choices=sorted(OrderFlowApp.LOG_VERBOSITY),
+                        default="normal", help="Detail of the periodic state report.")
+    parser.add_argument("--instrument", action="store_true",
+                        help="Record per-stage callback latency histograms, "
+                             "ticks/s per request and ingest queue lag.")
+    parser.add_argument("--stats-interval", type=float, default=0.0,
+                        help="Seconds between dumps of the --instrument "
+                             "statistics (0 disables the dump).")
+    parser.add_argument("--tick-by-tick", action="store_true",
+                        help="Subscribe to AllLast and BidAsk tick-by-tick "
+                             "streams instead of conflated reqMktData ticks.")
+    parser.add_argument("--market-depth", type=int, default=0,
+                        help="Subscribe to this many rows of level-2 depth per "
+                             "symbol and feed the book windows from it (0 "
+                             "keeps level-1 quotes).")
+    parser.add_argument("--expiry-interval", type=float, default=0.1,
+                        help="Seconds between background window expiry passes "
+                             "(0 disables the scheduler).")
+    parser.add_argument("--profile-bucket-seconds", type=float, default=5.0,
+                        help="Bucket length of the per-symbol volume profile "
+                             "that serves arbitrary window queries.")
     parser.add_argument("--client-id", type=int,
                         default=int(os.getenv("IB_CLIENT_ID", 1)),
                         help="IBKR client id to use for the session.")
@@ -409,8 +3722,28 @@ def main(argv: Optional[List[str]] = None) -> int:
         client_id=args.client_id,
         buffer_capacity=args.buffer_capacity,
         bin_size=args.price_bin_size,
+        buffer_path=args.buffer_path,
+        buffer_profile=args.buffer_profile,
+        price_scales=parse_price_scales(args.price_scale, symbols, args.min_tick),
+        partition_buffer=args.partition_buffer,
+        event_log=args.event_log,
+        spill_dir=args.spill_dir,
+        horizons=parse_horizons(args.horizon),
+        profile_bucket_seconds=args.profile_bucket_seconds,
+        expiry_interval=args.expiry_interval,
+        ingest_queue=args.ingest_queue,
+        log_interval=args.log_interval,
+        log_verbosity=args.log_verbosity,
+        instrument=args.instrument,
+        stats_interval=args.stats_interval,
+        tick_by_tick=args.tick_by_tick,
+        market_depth=args.market_depth,
     )
 
+    if args.warm_start:
+        app.register_contracts(contracts)
+        app.warm_start()
+
     try:
         app.connect_and_start()
     except Exception:
@@ -418,6 +3751,8 @@ def main(argv: Optional[List[str]] = None) -> int:
         return 1
 
     app.request_market_data(contracts)
+    if args.market_depth > 0:
+        app.request_market_depth(contracts)
 
     logger.info("Streaming market data. Press Ctrl+C to stop.")
     try:
@@ -428,6 +3763,17 @@ def main(argv: Optional[List[str]] = None) -> int:
     finally:
         app.disconnect()
         time.sleep(1.0)  # give the reader thread time to exit
+        if app.telemetry is not None:
+            app.telemetry.close()
+        if app.stats_reporter is not None:
+            app.stats_reporter.close()
+        if app.ingest_worker is not None:
+            app.ingest_worker.close()
+        if app.expiry_scheduler is not None:
+            app.expiry_scheduler.close()
+        app.buffer.flush()
+        if app.spill_writer is not None:
+            app.spill_writer.close()
         logger.info("Disconnected.")
     return 0
 
@@ -0,0 +1,162 @@
+"""
+OrderFlow_bench.py
+-------------------
+Micro-benchmarks for the OrderFlow_base data structures. Run it directly to
+compare ingestion and read strategies of the tick buffer at production
+capacity:
+
+    python OrderFlow_bench.py --capacity 180000 --rows 500000
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+from typing import List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from OrderFlow_base import OrderFlowBuffer, Snapshot
+
+
+# -----------------------------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------------------------
+
+def make_ticks(rows: int, seed: int = 7) -> dict:
+    """Build synthetic tick columns shaped like a busy SPY stream."""
+    rng = np.random.default_rng(seed)
+    start = time.time()
+    mid = 450.0 + np.cumsum(rng.normal(0.0, 0.01, rows))
+    return {
+        "timestamps": start + np.arange(rows) * 1e-4,
+        "ticker_ids": rng.integers(1, 4, rows, dtype="int32"),
+        "tick_types": rng.choice(np.array([0, 1, 2, 3, 4, 5, 8], dtype="int32"), rows),
+        "bid_size": rng.integers(1, 500, rows).astype("float64"),
+        "bid_price": np.round(mid - 0.01, 2),
+        "ask_price": np.round(mid + 0.01, 2),
+        "ask_size": rng.integers(1, 500, rows).astype("float64"),
+        "last_price": np.round(mid, 2),
+        "last_size": rng.integers(1, 100, rows).astype("float64"),
+        "volume": np.cumsum(rng.integers(1, 100, rows)).astype("float64"),
+    }
+
+
+def same_rows(left: np.ndarray, right: np.ndarray) -> bool:
+    """Field-wise equality for structured tick arrays, treating NaN == NaN."""
+    if left.shape != right.shape or left.dtype.names != right.dtype.names:
+        return False
+    return all(np.array_equal(left[name], right[name], equal_nan=True)
+               for name in left.dtype.names)
+
+
+def report(name: str, rows: int, elapsed: float) -> None:
+    logger.info("{:<28} {:>10,d} rows in {:8.4f}s -> {:>14,.0f} rows/s",
+                name, rows, elapsed, rows / elapsed if elapsed > 0 else float("inf"))
+
+
+# -----------------------------------------------------------------------------
+# Benchmarks
+# -----------------------------------------------------------------------------
+
+def bench_append(capacity: int, rows: int, batch_size: int, profile: str) -> None:
+    ticks = make_ticks(rows)
+
+    buffer = OrderFlowBuffer(capacity, profile=profile)
+    snapshot = Snapshot()
+    # IB callbacks deliver plain Python numbers, not numpy scalars.
+    columns = {name: col.tolist() for name, col in ticks.items()}
+    start = time.perf_counter()
+    for i in range(rows):
+        snapshot.bid_size = columns["bid_size"][i]
+        snapshot.bid_price = columns["bid_price"][i]
+        snapshot.ask_price = columns["ask_price"][i]
+        snapshot.ask_size = columns["ask_size"][i]
+        snapshot.last_price = columns["last_price"][i]
+        snapshot.last_size = columns["last_size"][i]
+        snapshot.volume = columns["volume"][i]
+        buffer.append(columns["ticker_ids"][i], columns["tick_types"][i],
+                      snapshot, columns["timestamps"][i])
+    report("append (per row)", rows, time.perf_counter() - start)
+    per_row = buffer.to_array()
+
+    buffer = OrderFlowBuffer(capacity, profile=profile)
+    start = time.perf_counter()
+    for lo in range(0, rows, batch_size):
+        hi = lo + batch_size
+        buffer.append_many(**{name: col[lo:hi] for name, col in ticks.items()})
+    report(f"append_many (batch={batch_size})", rows, time.perf_counter() - start)
+    batched = buffer.to_array()
+
+    if not same_rows(per_row, batched):
+        logger.error("Per-row and batched buffers differ")
+
+
+def measure(func, repeat: int) -> Tuple[float, int]:
+    """Return (seconds per call, peak bytes allocated by one call)."""
+    tracemalloc.start()
+    func()
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat, peak
+
+
+def bench_reads(capacity: int, tail_size: int, repeat: int, profile: str) -> None:
+    buffer = OrderFlowBuffer(capacity, profile=profile)
+    ticks = make_ticks(capacity + capacity // 3)  # full and wrapped
+    buffer.append_many(**ticks)
+
+    def walk_views():
+        views, _sequence = buffer.views()
+        return sum(len(view) for view in views)
+
+    cases = [
+        ("to_array()", buffer.to_array),
+        ("views()", walk_views),
+        (f"tail({tail_size})", lambda: buffer.tail(tail_size)),
+        (f"tail_views({tail_size})", lambda: buffer.tail_views(tail_size)),
+    ]
+    for name, func in cases:
+        per_call, peak = measure(func, repeat)
+        logger.info("{:<28} {:>12.1f} us/call, peak alloc {:>14,d} bytes",
+                    name, per_call * 1e6, peak)
+
+
+# -----------------------------------------------------------------------------
+# CLI handling
+# -----------------------------------------------------------------------------
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for the OrderFlow tick buffer."
+    )
+    parser.add_argument("--capacity", type=int, default=180_000,
+                        help="Buffer capacity used for the benchmark.")
+    parser.add_argument("--rows", type=int, default=500_000,
+                        help="Number of synthetic ticks to ingest.")
+    parser.add_argument("--batch-size", type=int, default=1_000,
+                        help="Rows per append_many call.")
+    parser.add_argument("--tail-size", type=int, default=5,
+                        help="Rows requested by the tail benchmarks.")
+    parser.add_argument("--repeat", type=int, default=50,
+                        help="Iterations per read benchmark.")
+    parser.add_argument("--profile", choices=sorted(OrderFlowBuffer.profiles),
+                        default="default", help="Buffer row layout to benchmark.")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logger.info("Profile {}: {} bytes per row", args.profile,
+                OrderFlowBuffer.profiles[args.profile].itemsize)
+    bench_append(args.capacity, args.rows, args.batch_size, args.profile)
+    bench_reads(args.capacity, args.tail_size, args.repeat, args.profile)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,8 @@
 """
 OrdreFLow_base_vis.py
 ----------------------
-Real-time Order Flow and Level 1 book visualization for UVXY using the IBKR API.
+Real-time Order Flow and Level 1 (or level-2 depth) book visualization for UVXY
+using the IBKR API.
 
 Launch this script (e.g. in Spyder) to connect to TWS/Gateway, stream ticks,
 accumulate sliding-window order-flow histograms (60s / 5min / 30min) and
@@ -167,13 +168,77 @@ class BookWindow:
         return {key: size for key, (ts, size) in self.latest.items()}
 
 
+class DepthBook:
+    """
+    Level-2 book in preallocated arrays: per side (row 0 asks, row 1 bids,
+    as IB's ``side`` codes) the prices, sizes and last-update times of up to
+    ``max_rows`` levels, best first. Updates shift at most ``max_rows``
+    entries in place; bins are only summed when :meth:`snapshot` is read.
+    """
+
+    SIDES = ("ask", "bid")
+    INSERT, UPDATE, DELETE = 0, 1, 2
+
+    def __init__(self, bin_size: float, max_rows: int = 10):
+        if max_rows <= 0:
+            raise ValueError("max_rows must be positive")
+        self.bin_size = bin_size
+        self.max_rows = max_rows
+        self.prices = np.full((2, max_rows), np.nan)
+        self.sizes = np.zeros((2, max_rows))
+        self.stamps = np.full((2, max_rows), -math.inf)
+        self.counts = [0, 0]
+
+    def update(self, timestamp: float, position: int, operation: int, side: int,
+               price: float, size: float) -> None:
+        if not 0 <= position < self.max_rows or side not in (0, 1):
+            return
+        rows = (self.prices[side], self.sizes[side], self.stamps[side])
+        count = self.counts[side]
+        if operation == self.DELETE:
+            if position >= count:
+                return
+            for row, empty in zip(rows, (np.nan, 0.0, -math.inf)):
+                row[position:count - 1] = row[position + 1:count]
+                row[count - 1] = empty
+            self.counts[side] = count - 1
+            return
+        if math.isnan(price) or math.isnan(size):
+            return
+        if operation != self.UPDATE or position >= count:
+            count = min(count, self.max_rows - 1)
+            position = min(position, count)
+            for row in rows:
+                row[position + 1:count + 1] = row[position:count]
+            self.counts[side] = count + 1
+        for row, value in zip(rows, (price, size, timestamp)):
+            row[position] = value
+
+    def snapshot(self, since: float = -math.inf) -> Dict[Tuple[str, float], float]:
+        """Total size per ``(side, bin)`` of levels updated at or after ``since``."""
+        result: Dict[Tuple[str, float], float] = defaultdict(float)
+        for index, side in enumerate(self.SIDES):
+            count = self.counts[index]
+            live = self.stamps[index, :count] >= since
+            bins = np.floor(self.prices[index, :count][live] / self.bin_size) * self.bin_size
+            for bin_key, size in zip(bins.tolist(), self.sizes[index, :count][live].tolist()):
+                result[(side, bin_key)] += size
+        return dict(result)
+
+
 PRICE_TICK_TYPES = {1: "BID", 2: "ASK", 4: "LAST"}
 SIZE_TICK_TYPES = {0: "BID_SIZE", 3: "ASK_SIZE", 5: "LAST_SIZE", 8: "VOLUME"}
+# Depth requests use the symbol's req_id plus this offset; IB refuses them
+# with these codes when depth is not available for the account.
+MARKET_DEPTH_OFFSET = 30_000
+MARKET_DEPTH_ERRORS = {309, 10092}
 
 
 class OrderFlowApp(EWrapper, EClient):
+    READ_TIMEOUT = 0.05  # seconds a reader retries before reusing its last result
+
     def __init__(self, host: str, port: int, client_id: int,
-                 buffer_capacity: int, bin_size: float):
+                 buffer_capacity: int, bin_size: float, market_depth: int = 0):
         EClient.__init__(self, wrapper=self)
         self.host = host
         self.port = port
@@ -192,7 +257,16 @@ class OrderFlowApp(EWrapper, EClient):
             "mid": BookWindow(5 * 60.0, bin_size, "Book_mid"),
             "slow": BookWindow(30 * 60.0, bin_size, "Book_slow"),
         }
-        self._data_lock = threading.Lock()
+        # With market depth the book panel reads this level-2 book instead
+        # of the level-1 book windows.
+        self.market_depth = market_depth
+        self.depth: Optional[DepthBook] = None
+        # Seqlock counter: odd while the IB thread is updating the windows.
+        # Readers retry instead of taking a lock, so the GUI never delays
+        # ticks; a reader that cannot get a clean read within READ_TIMEOUT
+        # returns its previous result from ``_last_reads``.
+        self._seq = 0
+        self._last_reads: Dict[str, object] = {}
 
     def connect_and_start(self) -> None:
         logger.info("Connecting to IBKR on {}:{} with client_id={}",
@@ -209,6 +283,10 @@ class OrderFlowApp(EWrapper, EClient):
 
     def error(self, reqId: int, errorCode: int, errorString: str):
         logger.error("Error. reqId={} code={} msg={}", reqId, errorCode, errorString)
+        if (errorCode in MARKET_DEPTH_ERRORS and reqId > MARKET_DEPTH_OFFSET
+                and self.depth is not None):
+            logger.warning("Market depth unavailable; book panel uses level-1 quotes")
+            self.depth = None
 
     def tickPrice(self, reqId: int, tickType: int, price: float,
                   attrib: TickAttrib):
@@ -237,11 +315,61 @@ class OrderFlowApp(EWrapper, EClient):
             snapshot.volume = float(size)
         self._record_tick(reqId, tickType, snapshot)
 
+    def updateMktDepth(self, reqId: int, position: int, operation: int, side: int,
+                       price: float, size: float):
+        self._record_depth(position, operation, side, price, size)
+
+    def updateMktDepthL2(self, reqId: int, position: int, marketMaker: str,
+                         operation: int, side: int, price: float, size: float,
+                         isSmartDepth: bool):
+        self._record_depth(position, operation, side, price, size)
+
+    def _record_depth(self, position: int, operation: int, side: int,
+                      price: float, size: float) -> None:
+        depth = self.depth
+        if depth is None:
+            return
+        now = time.time()
+        self._seq += 1
+        try:
+            depth.update(now, position, operation, side, float(price), float(size))
+        finally:
+            self._seq += 1
+
     def _record_tick(self, req_id: int, tick_type: int, snapshot: Snapshot):
         now = time.time()
-        with self._data_lock:
+        self._seq += 1
+        try:
             self.buffer.append(req_id, tick_type, snapshot)
             self._handle_aggregations(now, tick_type, snapshot)
+        finally:
+            self._seq += 1
+
+    def _read_consistent(self, key: str, read, default=None):
+        """
+        Run ``read`` until it completes without a concurrent tick update,
+        backing off between attempts. After READ_TIMEOUT the last clean
+        result stored under ``key`` (or ``default``) is returned instead,
+        so a busy feed can neither starve the GUI nor be delayed by it.
+        """
+        deadline = time.monotonic() + self.READ_TIMEOUT
+        delay = 0.0
+        while True:
+            start = self._seq
+            if not start & 1:  # odd: writer mid-update
+                try:
+                    result = read()
+                except RuntimeError:
+                    # A dict changed size while being copied; retry.
+                    pass
+                else:
+                    if self._seq == start:
+                        self._last_reads[key] = result
+                        return result
+            if time.monotonic() >= deadline:
+                return self._last_reads.get(key, default)
+            time.sleep(delay)
+            delay = min(max(delay * 2, 1e-4), 5e-3)
 
     def _handle_aggregations(self, timestamp: float, tick_type: int,
                               snapshot: Snapshot) -> None:
@@ -263,21 +391,40 @@ class OrderFlowApp(EWrapper, EClient):
                         contract.symbol, req_id)
             self.reqMktData(req_id, contract, "", False, False, [])
 
+    def request_market_depth(self, contracts: Iterable[Contract]) -> None:
+        """Subscribe to ``market_depth`` rows of level-2 data for the book panel."""
+        for req_id, contract in enumerate(contracts, start=1):
+            self.depth = DepthBook(self.bin_size, self.market_depth)
+            logger.info("Requesting {} rows of market depth for {} (req_id={})",
+                        self.market_depth, contract.symbol, req_id + MARKET_DEPTH_OFFSET)
+            self.reqMktDepth(req_id + MARKET_DEPTH_OFFSET, contract, self.market_depth,
+                             contract.exchange == "SMART", [])
+
     def get_orderflow_snapshot(self) -> Dict[str, Dict[float, float]]:
-        with self._data_lock:
-            return {name: hist.snapshot() for name, hist in self.orderflow_windows.items()}
+        return self._read_consistent("orderflow", lambda: {
+            name: hist.snapshot() for name, hist in self.orderflow_windows.items()
+        }, {})
 
     def get_book_snapshot(self) -> Dict[str, Dict[Tuple[str, float], float]]:
-        with self._data_lock:
-            return {name: book.snapshot() for name, book in self.book_windows.items()}
+        depth = self.depth
+        if depth is not None:
+            now = time.time()
+            return self._read_consistent("book", lambda: {
+                name: depth.snapshot(now - book.window_seconds)
+                for name, book in self.book_windows.items()
+            }, {})
+        return self._read_consistent("book", lambda: {
+            name: book.snapshot() for name, book in self.book_windows.items()
+        }, {})
 
     def get_latest_price(self) -> Optional[float]:
-        with self._data_lock:
+        def read() -> Optional[float]:
             # Using the first snapshot available
             if not self.snapshots:
                 return None
             any_snapshot = next(iter(self.snapshots.values()))
             return any_snapshot.last_price
+        return self._read_consistent("latest_price", read)
 
 
 def create_stock_contract(symbol: str) -> Contract:
@@ -301,12 +448,15 @@ class OrderFlowVisualizer:
             nrows=1, ncols=2, sharey=True, figsize=(12, 6),
             gridspec_kw={"width_ratios": [2, 1]}
         )
-        self.fig.suptitle(f"Order Flow & L1 Book — {symbol}", fontsize=16)
+        book_kind = "L2" if app.market_depth > 0 else "L1"
+        self.book_title = ("Depth Liquidity" if app.market_depth > 0
+                           else "Best Bid/Ask Liquidity")
+        self.fig.suptitle(f"Order Flow & {book_kind} Book — {symbol}", fontsize=16)
         self.ax_profile.set_xlabel("Volume")
         self.ax_profile.set_ylabel("Price")
         self.ax_profile.set_title("Order Flow")
 
-        self.ax_book.set_title("Best Bid/Ask Liquidity")
+        self.ax_book.set_title(self.book_title)
         self.ax_book.set_xlabel("Size (Bid ←   → Ask)")
 
         self.animation = FuncAnimation(
@@ -337,7 +487,7 @@ class OrderFlowVisualizer:
             self.ax_profile.clear()
             self.ax_book.clear()
             self.ax_profile.set_title("Order Flow (waiting for data)")
-            self.ax_book.set_title("Best Bid/Ask Liquidity")
+            self.ax_book.set_title(self.book_title)
             return
 
         # Build bar arrays for each horizon (side-by-side grouped bars)
@@ -377,7 +527,7 @@ class OrderFlowVisualizer:
 
         # Book plot
         self.ax_book.clear()
-        self.ax_book.set_title("Best Bid/Ask Liquidity")
+        self.ax_book.set_title(self.book_title)
         self.ax_book.set_xlabel("Size (Bid ←   → Ask)")
         color_map = {
             "fast": ("#1f77b4", "#d62728"),
@@ -434,6 +584,9 @@ def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
                         help="TWS paper port or IB Gateway port.")
     parser.add_argument("--update-interval", type=int, default=1000,
                         help="Plot update interval in milliseconds.")
+    parser.add_argument("--market-depth", type=int, default=0,
+                        help="Rows of level-2 depth to plot in the book panel "
+                             "(0 plots level-1 bid/ask liquidity).")
     return parser.parse_args(argv)
 
 
@@ -450,6 +603,7 @@ def main(argv: Optional[List[str]] = None) -> int:
         client_id=args.client_id,
         buffer_capacity=args.buffer_capacity,
         bin_size=args.price_bin_size,
+        market_depth=args.market_depth,
     )
 
     try:
@@ -459,6 +613,8 @@ def main(argv: Optional[List[str]] = None) -> int:
         return 1
 
     app.request_market_data([contract])
+    if args.market_depth > 0:
+        app.request_market_depth([contract])
     logger.info("Streaming market data. Close the figure window to stop.")
 
     visualizer = OrderFlowVisualizer(app, symbol, args.update_interval)
@@ -0,0 +1,42 @@
+import numpy as np
+
+from OrderFlow_base import OrderFlowBuffer
+
+
+def _torn_buffer(path, capacity=200, committed=300, torn=100):
+    """Commit ``committed`` rows, then die halfway through a ``torn`` batch."""
+    buffer = OrderFlowBuffer(capacity, path=str(path))
+    buffer.append_many(np.arange(committed, dtype="float64"), 1, 5)
+    # What append_many does before it publishes ``sequence``: claim the
+    # slots and overwrite (part of) them.
+    buffer._claim(torn)
+    start = buffer._write_idx
+    buffer._data["timestamp"][start:start + torn // 2] = -1.0
+    buffer.flush()
+    return buffer
+
+
+def test_reopen_after_torn_append_drops_overwritten_rows(tmp_path):
+    path = tmp_path / "ring.ofb"
+    _torn_buffer(path)
+
+    reopened = OrderFlowBuffer.open(str(path), readonly=False)
+    rows = reopened.to_array()
+    # Rows 200..299 survive; 100..199 sat in the slots of the torn batch.
+    assert rows.shape[0] == 100
+    np.testing.assert_array_equal(rows["timestamp"], np.arange(200, 300))
+    assert reopened.oldest_sequence == reopened.sequence - reopened.capacity
+
+    reopened.append_many(np.arange(300, 350, dtype="float64"), 1, 5)
+    rows = reopened.to_array()
+    np.testing.assert_array_equal(rows["timestamp"], np.arange(200, 350))
+
+
+def test_readonly_reader_skips_slots_of_torn_append(tmp_path):
+    path = tmp_path / "ring.ofb"
+    _torn_buffer(path)
+
+    reader = OrderFlowBuffer.open(str(path), readonly=True)
+    stamps = reader.to_array()["timestamp"]
+    assert np.all(np.diff(stamps) > 0)
+    np.testing.assert_array_equal(stamps, np.arange(200, 300))